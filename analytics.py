@@ -0,0 +1,217 @@
+"""Patient and self-pay aggregates for the admin analytics API.
+
+Aggregates are computed in SQL with GROUP BY over the day each patient was
+created, and kept per day in AnalyticsCache. A report over a date range
+only queries the days it has not seen yet, then merges the cached days in
+Python. Days that got new patients or self-pay selections since the last
+check are recomputed, so the cache follows new rows without a full rescan.
+Self-pay figures belong to the patient's day, which makes uptake (patients
+with any selection / patients) add up across days.
+"""
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import metrics
+from models import db, Patient, SelfPayItem
+
+BUCKETS = ('day', 'week', 'month')
+
+# Longest range a report may cover; bounds the cache at one entry per day
+MAX_RANGE_DAYS = 3 * 366
+
+# Ages at or above this are reported in one band
+OLDEST_BAND = 90
+
+UNKNOWN = '未填寫'
+
+
+def _as_date(value):
+    # SQLite's date() returns a string, other backends a date
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+def _empty_day():
+    return {'patients': 0, 'self_pay_patients': 0, 'operations': Counter(), 'ages': Counter(), 'items': {}}
+
+
+def age_band(low):
+    """Label of the ten-year band starting at low"""
+    if low is None:
+        return UNKNOWN
+    if low >= OLDEST_BAND:
+        return f'{OLDEST_BAND}+'
+    return f'{low}-{low + 9}'
+
+
+def compute_days(start, end):
+    """Aggregates of patients created on days start <= day < end, keyed by day.
+
+    Every day in the range gets an entry, days without patients included.
+    """
+    days = {start + timedelta(days=n): _empty_day() for n in range((end - start).days)}
+    day = db.func.date(Patient.created_at)
+    in_range = (
+        Patient.created_at >= datetime.combine(start, datetime.min.time()),
+        Patient.created_at < datetime.combine(end, datetime.min.time()),
+    )
+
+    # One pass over the patients gives both the operation mix and the age bands
+    band = (Patient.age / 10) * 10
+    patients = db.session.query(day, Patient.operation, band, db.func.count(Patient.id)) \
+        .filter(*in_range).group_by(day, Patient.operation, band)
+    for value, operation, low, count in patients:
+        entry = days[_as_date(value)]
+        entry['patients'] += count
+        entry['operations'][operation or UNKNOWN] += count
+        entry['ages'][age_band(low)] += count
+
+    selections = db.session.query(day, SelfPayItem.item_name, db.func.count(SelfPayItem.id),
+                                  db.func.sum(SelfPayItem.price)) \
+        .join(Patient, Patient.id == SelfPayItem.patient_id) \
+        .filter(*in_range).group_by(day, SelfPayItem.item_name)
+    for value, item, count, revenue in selections:
+        days[_as_date(value)]['items'][item or UNKNOWN] = (count, revenue or 0.0)
+
+    uptake = db.session.query(day, db.func.count(db.distinct(SelfPayItem.patient_id))) \
+        .join(Patient, Patient.id == SelfPayItem.patient_id) \
+        .filter(*in_range).group_by(day)
+    for value, count in uptake:
+        days[_as_date(value)]['self_pay_patients'] = count
+    return days
+
+
+def changed_days(since):
+    """Days whose patients were created, or made self-pay selections, at or after since"""
+    day = db.func.date(Patient.created_at)
+    created = db.session.query(day).filter(Patient.created_at >= since).distinct()
+    selected = db.session.query(day).join(SelfPayItem, SelfPayItem.patient_id == Patient.id) \
+        .filter(SelfPayItem.selected_at >= since).distinct()
+    return {_as_date(value) for (value,) in created.union(selected)}
+
+
+def bucket_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def summarize(days, bucket='day', top=10):
+    """Merge per-day aggregates into totals, distributions and a series per bucket"""
+    operations, ages = Counter(), Counter()
+    items = {}
+    series = {}
+    for day in sorted(days):
+        entry = days[day]
+        operations.update(entry['operations'])
+        ages.update(entry['ages'])
+        point = series.setdefault(bucket_start(day, bucket), {'patients': 0, 'self_pay_patients': 0, 'revenue': 0.0})
+        point['patients'] += entry['patients']
+        point['self_pay_patients'] += entry['self_pay_patients']
+        for item, (count, revenue) in entry['items'].items():
+            totals = items.setdefault(item, {'selected': 0, 'revenue': 0.0})
+            totals['selected'] += count
+            totals['revenue'] += revenue
+            point['revenue'] += revenue
+
+    patients = sum(point['patients'] for point in series.values())
+    self_pay_patients = sum(point['self_pay_patients'] for point in series.values())
+    # Keep the most common operations; the free-text tail is folded into one entry
+    top_operations = [{'operation': name, 'patients': count} for name, count in operations.most_common(top)]
+    rest = sum(operations.values()) - sum(entry['patients'] for entry in top_operations)
+    if rest:
+        top_operations.append({'operation': '其他', 'patients': rest})
+    return {
+        'totals': {
+            'patients': patients,
+            'self_pay_patients': self_pay_patients,
+            'uptake': round(self_pay_patients / patients, 4) if patients else 0.0,
+            'revenue': sum(totals['revenue'] for totals in items.values()),
+        },
+        'operations': top_operations,
+        'ages': dict(sorted(ages.items())),
+        'items': sorted(({'item': name, **totals} for name, totals in items.items()),
+                       key=lambda entry: -entry['revenue']),
+        'series': [dict(bucket=start.isoformat(), **point) for start, point in series.items()],
+    }
+
+
+class AnalyticsCache:
+    """Per-day aggregates kept in memory and brought up to date on use.
+
+    Every ``refresh_interval`` seconds at most, days with rows written since
+    the previous check (minus ``lag`` seconds, to catch rows committed late
+    by the write-behind queue or another worker) are recomputed.
+    """
+
+    def __init__(self, refresh_interval=10, lag=300):
+        self.refresh_interval = refresh_interval
+        self.lag = lag
+        self._days = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self, now):
+        if self._checked_at is None or now - self._checked_at < timedelta(seconds=self.refresh_interval):
+            return
+        stale = sorted(changed_days(self._checked_at - timedelta(seconds=self.lag)) & self._days.keys())
+        self._checked_at = now
+        with metrics.timer('analytics_query_seconds', kind='refresh'):
+            for day in stale:
+                self._days.update(compute_days(day, day + timedelta(days=1)))
+
+    def days(self, first, last):
+        """Per-day aggregates for first <= day <= last; must run inside an application context"""
+        with self._lock:
+            now = datetime.utcnow()
+            self._refresh(now)
+            missing = [first + timedelta(days=n) for n in range((last - first).days + 1)
+                       if first + timedelta(days=n) not in self._days]
+            if missing:
+                if self._checked_at is None:
+                    self._checked_at = now
+                with metrics.timer('analytics_query_seconds', kind='fill'):
+                    self._days.update(compute_days(missing[0], missing[-1] + timedelta(days=1)))
+            return {day: self._days[day] for day in self._days if first <= day <= last}
+
+    def report(self, first, last, bucket='day', top=10):
+        report = summarize(self.days(first, last), bucket, top)
+        report.update(date_from=first.isoformat(), date_to=last.isoformat(), bucket=bucket)
+        return report
+
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+            self._checked_at = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'days': len(self._days),
+                'checked_at': self._checked_at.isoformat() if self._checked_at else None,
+            }
+
+
+def parse_report_args(args, today=None):
+    """Read date_from, date_to (YYYY-MM-DD, inclusive), bucket and top from query args.
+
+    Defaults to the 30 days up to today. Raises ValueError on bad input.
+    """
+    today = today or datetime.utcnow().date()
+    last = date.fromisoformat(args['date_to']) if args.get('date_to') else today
+    first = date.fromisoformat(args['date_from']) if args.get('date_from') else last - timedelta(days=29)
+    if first > last:
+        raise ValueError("date_from must not be after date_to")
+    if (last - first).days >= MAX_RANGE_DAYS:
+        raise ValueError(f"date range must be shorter than {MAX_RANGE_DAYS} days")
+    bucket = args.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+    top = int(args.get('top', 10))
+    if top < 1:
+        raise ValueError("top must be positive")
+    return first, last, bucket, top
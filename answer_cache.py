@@ -0,0 +1,150 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from recommendations import estimate_asa, recommend, worry_topics
+
+# Punctuation and whitespace dropped when normalizing a question
+_IGNORED_CHARS = re.compile(r"[\s　-〿＀-／：-＠［-｀｛-･!-/:-@\[-`{-~]+")
+
+# Answers that mean "nothing in particular"
+_NONE_ANSWERS = {"", "無", "沒有", "没有", "none", "no"}
+
+
+def normalize_text(text):
+    """Normalize free text so trivially different phrasings share a key"""
+    text = unicodedata.normalize('NFKC', str(text or '')).lower()
+    text = _IGNORED_CHARS.sub('', text)
+    return "" if text in _NONE_ANSWERS else text
+
+
+def age_band(age):
+    """Bucket age at the thresholds the self-pay rules care about"""
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return "unknown"
+    if age < 18:
+        return "child"
+    if age <= 50:
+        return "adult"
+    if age <= 65:
+        return "senior"
+    return "elderly"
+
+
+def shared_features(info):
+    """Patient features a shareable answer is built from.
+
+    The free-text answers are reduced to what the rules read from them: the
+    ASA class from the medical history, the worry topics and the recommended
+    self-pay items, so patients who differ only in wording share answers.
+    """
+    return {
+        'age_band': age_band(info.get('age')),
+        'sex': normalize_text(info.get('sex')),
+        'operation': normalize_text(info.get('operation')),
+        'cfs': normalize_text(info.get('cfs')),
+        'asa': estimate_asa(info),
+        'worries': worry_topics(info),
+        'items': list(recommend(info)),
+    }
+
+
+def make_key(question, info):
+    """Build a cache key from the question and the shared features of the patient.
+
+    Every patient value in the prompt of a shareable answer must come from
+    shared_features, so that it is part of the key.
+    """
+    parts = [normalize_text(question), shared_features(info)]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """LRU + TTL cache of LLM answers with an optional SQLite-backed tier.
+
+    The in-memory tier holds up to ``max_size`` answers for ``ttl`` seconds.
+    When ``db_path`` is set, answers are also written to SQLite so they
+    survive restarts and are shared between worker processes.
+    """
+
+    def __init__(self, max_size=1024, ttl=24 * 3600, db_path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answer_cache "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, key):
+        """Return the cached answer for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, created_at = entry
+                if now - created_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, created_at FROM answer_cache WHERE key = ? AND created_at > ?",
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row:
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    self.persistent_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key, response):
+        """Store an answer in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._store(key, response, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO answer_cache (key, response, created_at) VALUES (?, ?, ?)",
+                    (key, response, now)
+                )
+                self._db.execute("DELETE FROM answer_cache WHERE created_at <= ?", (now - self.ttl,))
+                self._db.commit()
+
+    def _store(self, key, response, created_at):
+        self._entries[key] = (response, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """Return hit/miss counters"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "persistent_hits": self.persistent_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
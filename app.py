@@ -1,48 +1,192 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
-from datetime import datetime
+import flask
+from flask import Flask, Response, request, g, jsonify, session, redirect, url_for, flash, stream_with_context, abort
+from datetime import datetime, timedelta
+import base64
 import json
-import google.generativeai as genai
+import logging
+import threading
+import time
 import os
 from dotenv import load_dotenv
-from markdown import markdown
-import bleach
 from flask_login import login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, User, Patient, SelfPayItem, ChatHistory, init_login_manager
+from models import db, User, Patient, SelfPayItem, ChatHistory, PatientDailyCount, init_login_manager, increment_daily_count
+from llm_executor import LLMExecutor, LLMBusyError
+from llm_client import create_model
+from llm_resilience import ResilientLLM, CircuitBreaker, TokenBucket, CircuitOpenError
+from answer_cache import AnswerCache, make_key, normalize_text, shared_features
+from session_store import ServerSideSessionInterface, create_backend
+from write_behind import WriteBehindQueue
+from migrations import migrate
+from db_config import configure_database, tune_engine
+import export
+import metrics
+from rendering import render_markdown, finished_length
+from recommendations import ITEMS, WORRY_LABELS, recommend, estimate_asa, score_patients
+from conversation import fold_history, format_history
+from analytics import AnalyticsCache, parse_report_args
 
 # Load environment variables
 load_dotenv()
 
+# Leveled key=value logging; LOG_LEVEL=WARNING silences the per-request lines
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    format='%(asctime)s %(levelname)s %(name)s %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 # Initialize Flask app
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')  # Make sure to set this in .env
 
-# Configure SQLAlchemy
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///patients.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True  # Enable SQL query logging
+# Configure SQLAlchemy from DATABASE_URL, SQLALCHEMY_ECHO and the pool/PRAGMA settings in db_config.py
+configure_database(app)
+
+# Configure the LLM backend
+app.config['LLM_BACKEND'] = os.getenv('LLM_BACKEND', 'gemini')  # gemini, or fake to run without API quota
+app.config['FAKE_LLM_LATENCY'] = float(os.getenv('FAKE_LLM_LATENCY', 0.5))  # Seconds to the first token
+app.config['FAKE_LLM_TOKENS_PER_SECOND'] = float(os.getenv('FAKE_LLM_TOKENS_PER_SECOND', 200))  # Generation speed
+app.config['FAKE_LLM_RESPONSE_TOKENS'] = int(os.getenv('FAKE_LLM_RESPONSE_TOKENS', 400))  # Answer length
+app.config['FAKE_LLM_ERROR_RATE'] = float(os.getenv('FAKE_LLM_ERROR_RATE', 0))  # Share of calls that fail
+
+# Configure LLM dispatch
+app.config['LLM_MAX_CONCURRENCY'] = int(os.getenv('LLM_MAX_CONCURRENCY', 4))  # Gemini calls running at once
+app.config['LLM_MAX_QUEUE'] = int(os.getenv('LLM_MAX_QUEUE', 8))  # Calls allowed to wait for a free slot
+app.config['LLM_TIMEOUT'] = float(os.getenv('LLM_TIMEOUT', 60))  # Seconds before a call is abandoned
+app.config['LLM_RETRY_AFTER'] = int(os.getenv('LLM_RETRY_AFTER', 5))  # Retry-After hint when busy
+
+# Configure LLM retries, rate limiting and the circuit breaker
+app.config['LLM_RATE_PER_MINUTE'] = float(os.getenv('LLM_RATE_PER_MINUTE', 60))  # Requests per minute our Gemini quota allows, for all workers together; 0 disables the limit
+app.config['LLM_RATE_BURST'] = int(os.getenv('LLM_RATE_BURST', 10))  # Requests all workers together may send back to back
+app.config['LLM_RATE_WORKERS'] = int(os.getenv('WEB_CONCURRENCY', 1))  # Worker processes sharing the quota; gunicorn reads the same variable
+app.config['LLM_RATE_MAX_WAIT'] = float(os.getenv('LLM_RATE_MAX_WAIT', 2))  # Seconds a call may wait for quota before the busy reply
+app.config['LLM_RETRIES'] = int(os.getenv('LLM_RETRIES', 2))  # Extra attempts after a transient error
+app.config['LLM_BACKOFF_BASE'] = float(os.getenv('LLM_BACKOFF_BASE', 0.5))  # Backoff ceiling before the first retry, doubled for each next one
+app.config['LLM_BACKOFF_MAX'] = float(os.getenv('LLM_BACKOFF_MAX', 8))  # Longest backoff in seconds
+app.config['LLM_BREAKER_THRESHOLD'] = int(os.getenv('LLM_BREAKER_THRESHOLD', 5))  # Consecutive failures that open the circuit
+app.config['LLM_BREAKER_RESET'] = float(os.getenv('LLM_BREAKER_RESET', 30))  # Seconds the circuit stays open before a trial call
+
+# Configure how much of the conversation is sent with each question
+app.config['CONTEXT_HISTORY_TOKENS'] = int(os.getenv('CONTEXT_HISTORY_TOKENS', 2000))  # Estimated tokens of earlier turns per prompt
+app.config['CONTEXT_SUMMARY_TOKENS'] = int(os.getenv('CONTEXT_SUMMARY_TOKENS', 400))  # Share of that budget for the summary of older turns
+
+# Configure the admin analytics cache
+app.config['ANALYTICS_REFRESH_INTERVAL'] = float(os.getenv('ANALYTICS_REFRESH_INTERVAL', 10))  # Seconds between checks for new rows
+app.config['ANALYTICS_REFRESH_LAG'] = float(os.getenv('ANALYTICS_REFRESH_LAG', 300))  # Seconds of overlap between checks, for rows committed late
+
+# Configure the answer cache for repeated questions
+app.config['ANSWER_CACHE_SIZE'] = int(os.getenv('ANSWER_CACHE_SIZE', 1024))  # Answers kept in memory
+app.config['ANSWER_CACHE_TTL'] = int(os.getenv('ANSWER_CACHE_TTL', 24 * 3600))  # Seconds an answer stays valid
+app.config['ANSWER_CACHE_DB'] = os.getenv('ANSWER_CACHE_DB', '')  # SQLite file for the persistent tier; empty disables it
+
+# Configure /metrics; empty leaves it open to the scraper
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')  # Bearer token required to read /metrics
+# Every worker writes its metrics to METRICS_DIR, so a scrape of any worker reports them all
+app.config['METRICS_DIR'] = os.getenv('METRICS_DIR', os.path.join(app.root_path, 'metrics'))  # Shared by the workers on a host; empty keeps per-process metrics
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))  # Seconds between snapshots of a worker's metrics
+if app.config['METRICS_DIR']:
+    metrics.configure(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'])
+
+# Configure server-side sessions; the cookie only carries an opaque session id
+# Defaults to a SQLite file shared by every worker on the host; memory:// only suits a single process
+app.config['SESSION_STORE_URI'] = os.getenv('SESSION_STORE_URI', f"sqlite:///{os.path.join(app.root_path, 'sessions.db')}")  # memory://, sqlite:///path or redis://host:port/0
+app.config['SESSION_TTL'] = int(os.getenv('SESSION_TTL', 24 * 3600))  # Seconds a conversation is kept
+session_backend = create_backend(app.config['SESSION_STORE_URI'])
+
+class TimedSessionInterface(ServerSideSessionInterface):
+    """Server-side sessions with load and save times recorded in metrics"""
+
+    def open_session(self, app, request):
+        with metrics.timer('session_seconds', operation='open'):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with metrics.timer('session_seconds', operation='save'):
+            return super().save_session(app, session, response)
+
+app.session_interface = TimedSessionInterface(session_backend, ttl=app.config['SESSION_TTL'])
 
 # Initialize database
 db.init_app(app)
 
-# Create tables within application context
+# Configure write-behind persistence of patients, chat turns and self-pay selections
+app.config['WRITE_BEHIND_ENABLED'] = os.getenv('WRITE_BEHIND_ENABLED', '1') == '1'  # 0 writes synchronously
+app.config['WRITE_BEHIND_BATCH_SIZE'] = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 100))  # Jobs per transaction
+app.config['WRITE_BEHIND_FLUSH_INTERVAL'] = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', 0.5))  # Max seconds a job waits
+write_queue = WriteBehindQueue(
+    app, db,
+    batch_size=app.config['WRITE_BEHIND_BATCH_SIZE'],
+    flush_interval=app.config['WRITE_BEHIND_FLUSH_INTERVAL'],
+    enabled=app.config['WRITE_BEHIND_ENABLED']
+)
+metrics.gauge('write_queue_depth', lambda: write_queue.stats()['depth'])
+metrics.gauge('write_queue_lag_seconds', write_queue.lag, aggregate='max')
+
+# Tune connections as they open; tables are created by create_app() or init_db.py, not at import
 with app.app_context():
-    db.create_all()
-    print("Database tables created successfully!")
+    tune_engine(db.engine, app.config)
+
+@db.event.listens_for(db.session, 'before_commit')
+def start_commit_timer(session):
+    session.info['commit_started'] = time.perf_counter()
+
+@db.event.listens_for(db.session, 'after_commit')
+def record_commit_time(session):
+    started = session.info.pop('commit_started', None)
+    if started is not None:
+        metrics.observe('db_commit_seconds', time.perf_counter() - started)
 
 # Initialize Flask-Login
 init_login_manager(app)
 
 # 問題流程
 questions = {
-    "name": "請問您的姓名是？",
+    "name": "您好！我是麻醉諮詢助手。為了更好地為您服務，請告訴我您的姓名。",
     "age": "請問您的年齡是？",
     "sex": "請問您的性別是？（男/女）",
-    "cfs": "您是否能夠自行外出，不需要他人協助？",
-    "medical_history": "請告訴我您的過去病史（例如：高血壓、糖尿病、心臟病等）？如果沒有，請回答「無」",
     "operation": "請問您預計要進行什麼手術？",
-    "worry": "您有什麼擔心的地方嗎？"
+    "cfs": "您是否能夠自行外出，不需要他人協助？（是/否）",
+    "medical_history": "請問您有什麼重要的病史嗎？例如：高血壓、糖尿病、心臟病等。如果沒有，請回答「無」。",
+    "worry": "您最擔心什麼？您可以點選或輸入您的擔憂。如果沒有特別擔心的，請點選「沒有特別擔心」。"
+}
+
+# Intake answer parsers: return the value to store or raise ValueError with the reply to send
+def required(error):
+    def parse(message):
+        if len(message.strip()) < 1:
+            raise ValueError(error)
+        return message
+    return parse
+
+def parse_age(message):
+    try:
+        age = int(str(message).replace("歲", "").strip())
+    except ValueError:
+        raise ValueError("抱歉，我沒有理解您的年齡，請直接輸入數字，例如：25")
+    if age < 0 or age > 150:
+        raise ValueError("請輸入有效的年齡（0-150歲）")
+    return age
+
+def parse_sex(message):
+    if message not in ["男", "女"]:
+        raise ValueError("抱歉，請選擇「男」或「女」")
+    return message
+
+def parse_cfs(message):
+    return "是" if str(message).lower() in ["是", "yes", "y", "可以"] else "否"
+
+# Intake steps in order: each answer is parsed and stored under the step's name,
+# then the next step's question from `questions` is asked
+intake_steps = {
+    "name": {"parse": required("請告訴我您的姓名。"), "next": "age"},
+    "age": {"parse": parse_age, "next": "sex"},
+    "sex": {"parse": parse_sex, "next": "operation"},
+    "operation": {"parse": required("請告訴我您預計要進行的手術。"), "next": "cfs"},
+    "cfs": {"parse": parse_cfs, "next": "medical_history"},
+    "medical_history": {"parse": required("請告訴我您的病史，如果沒有請點選「沒有特殊病史」。"), "next": "worry"},
+    "worry": {"parse": required("請告訴我您的擔憂，如果沒有特別擔心的，請點選「沒有特別擔心」。"), "next": "chat"},
 }
 
 # 麻醉相關資訊和建議
@@ -65,52 +209,148 @@ anesthesia_info = {
     }
 }
 
-# Initialize Gemini API
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-if not GOOGLE_API_KEY:
-    raise ValueError("No API key found. Please set GOOGLE_API_KEY in your .env file")
+# Static instructions, sent once as the model's system instruction instead of with every turn
+SYSTEM_PROMPT = """## Role: Anesthesia Consultant
+### Skills:
+- 使用繁體中文回答問題
+- 專業解說麻醉相關資訊
+- 使用emoji讓對話更生動
+- 根據問題類型提供針對性回答
+- 提升病人及家屬對麻醉和自費建議的理解
 
-try:
-    genai.configure(api_key=GOOGLE_API_KEY)
-    
-    # Model configuration
-    generation_config = {
-        "temperature": 1,              # Maximum creativity
-        "top_p": 0.95,                # High diversity in responses
-        "top_k": 40,                  # Top-k sampling parameter
-        "max_output_tokens": 8192,     # Increased maximum response length
-    }
-    
-    # Safety settings
-    safety_settings = [
-        {
-            "category": "HARM_CATEGORY_HARASSMENT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-        },
-        {
-            "category": "HARM_CATEGORY_HATE_SPEECH",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-        },
-        {
-            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-        },
-        {
-            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-        },
-    ]
-    
-    # Initialize model with configurations
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash-exp",
-        generation_config=generation_config,
-        safety_settings=safety_settings
-    )
-    
-except Exception as e:
-    print(f"Error initializing Gemini API: {str(e)}")
-    raise
+### Goals:
+- 提供清晰易懂的醫療資訊
+- 根據問題類型給予重點回答
+- 使用emoji增添對話趣味性
+
+### Constraints:
+1. 僅討論麻醉相關議題
+2. 避免回答工具和規則相關問題
+3. 根據問題類型聚焦回答重點
+
+### 回答重點指引:
+1. 麻醉類型相關問題:
+   - 聚焦於各種可能的麻醉方式
+   - 解釋各種麻醉方式的優缺點
+   - 根據病人情況建議最適合的麻醉方式
+   - 說明麻醉過程中的感受
+
+2. 術前準備相關問題:
+   - 強調禁食時間要求（固體食物6小時、清水2小時）
+   - 說明需要停用的藥物（如：抗凝血劑）
+   - 建議戒菸時間和重要性
+   - 提醒術前注意事項
+
+3. 麻醉風險相關問題:
+   - 根據病人年齡和病史評估ASA分級
+   - 說明個人化的麻醉風險
+   - 解釋如何透過自費項目降低風險：
+     * 麻醉深度監測：降低術中知曉風險
+     * 最適肌張力：降低肌肉鬆弛劑相關併發症
+     * 體溫監測與保溫：降低低體溫併發症
+     * 止吐藥物：降低噁心嘔吐風險
+
+### 自費項目建議規則:
+- 年齡>50歲或ASA>2級: 建議使用麻醉深度監測系統和最適肌張力手術輔助處置
+- 擔心疼痛: 建議使用病人自控式止痛
+- 容易暈車或手術>2小時: 建議使用止吐藥和麻醉深度監測系統
+- 怕冷或手術>1小時: 建議使用溫毯並解釋保溫重要性
+- 失眠或精神緊張: 建議使用麻醉深度監測系統
+- 體弱或年長: 建議使用麻醉深度監測系統和最適肌張力手術輔助處置
+
+請根據每則訊息附上的病人資訊，提供專業且易懂的回答。使用markdown格式並加入適當的emoji增添親和力。回答時請依據問題類型(麻醉類型/術前準備/麻醉風險)聚焦於相關重點。"""
+
+# The LLM client is built on first use: importing the Gemini SDK alone takes about half a second
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    """Return the LLM client (Gemini, or the local fake backend), creating it once"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                try:
+                    _model = create_model(app.config, SYSTEM_PROMPT)
+                except Exception:
+                    logger.exception("llm init failed backend=%s", app.config['LLM_BACKEND'])
+                    raise
+    return _model
+
+def call_model(*args, **kwargs):
+    """Call the LLM once; runs on the LLM pool, so a failed first init is handled like a failed call"""
+    return get_model().generate_content(*args, **kwargs)
+
+# Retry transient errors within the call timeout, stay inside the API quota
+# and stop calling Gemini while it keeps failing. Each worker process has its
+# own bucket, so it gets an equal share of the quota and the burst.
+rate_workers = max(app.config['LLM_RATE_WORKERS'], 1)
+rate_per_second = app.config['LLM_RATE_PER_MINUTE'] / 60 / rate_workers
+rate_burst = max(app.config['LLM_RATE_BURST'] // rate_workers, 1)
+resilient_llm = ResilientLLM(
+    call_model,
+    breaker=CircuitBreaker(
+        failure_threshold=app.config['LLM_BREAKER_THRESHOLD'],
+        reset_timeout=app.config['LLM_BREAKER_RESET']
+    ),
+    bucket=TokenBucket(rate_per_second, rate_burst) if rate_per_second > 0 else None,
+    retries=app.config['LLM_RETRIES'],
+    base_delay=app.config['LLM_BACKOFF_BASE'],
+    max_delay=app.config['LLM_BACKOFF_MAX'],
+    budget=app.config['LLM_TIMEOUT'],
+    max_wait=app.config['LLM_RATE_MAX_WAIT']
+)
+
+def generate_content(*args, **kwargs):
+    """Call the LLM with retries, rate limiting and the circuit breaker"""
+    return resilient_llm.generate_content(*args, **kwargs)
+
+# Run Gemini calls on a bounded pool so slow generations can't pin every web worker
+llm_executor = LLMExecutor(
+    max_concurrency=app.config['LLM_MAX_CONCURRENCY'],
+    max_queue=app.config['LLM_MAX_QUEUE'],
+    timeout=app.config['LLM_TIMEOUT']
+)
+
+# Per-day aggregates for /admin/api/analytics, refreshed as new rows arrive
+analytics_cache = AnalyticsCache(
+    refresh_interval=app.config['ANALYTICS_REFRESH_INTERVAL'],
+    lag=app.config['ANALYTICS_REFRESH_LAG']
+)
+
+# Cache answers to near-duplicate questions from patients with the same relevant features
+answer_cache = AnswerCache(
+    max_size=app.config['ANSWER_CACHE_SIZE'],
+    ttl=app.config['ANSWER_CACHE_TTL'],
+    db_path=app.config['ANSWER_CACHE_DB'] or None
+)
+
+def render_template(template_name, **context):
+    """flask.render_template with the render time recorded per template"""
+    with metrics.timer('template_render_seconds', template=template_name):
+        return flask.render_template(template_name, **context)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Streaming responses are timed up to the first byte, not the end of the stream
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.observe('http_request_seconds', time.perf_counter() - started, route=route)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Scrapers send METRICS_TOKEN as a bearer token when one is configured
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def home():
@@ -126,57 +366,118 @@ def chat_post():
     message = data.get('message', '')
     user_id = data.get('user_id', 'default')
 
-    # Initialize chat history and patient info if not exists
+    # Initialize patient info if not exists
     if user_id not in session:
-        session[user_id] = {}
-        session[user_id]['chat_history'] = []
-        session[user_id]['patient_info'] = {}
-        session[user_id]['current_step'] = "name"
-        response = "您好！我是麻醉諮詢助手。為了更好地為您服務，請告訴我您的姓名。"
-        session[user_id]['chat_history'].append({"role": "bot", "message": response})
+        start_conversation(user_id)
+        response = questions["name"]
+        append_chat_history(user_id, "bot", response)
         return jsonify({"response": format_response(response)})
 
-    # Save user message
-    session[user_id]['chat_history'].append({"role": "user", "message": message})
-
     # Get current step and process message
     step = session[user_id]['current_step']
-    response = handle_patient_info(user_id, step, message)
 
-    # Save bot response
-    session[user_id]['chat_history'].append({"role": "bot", "message": response})
+    metrics.inc('chat_turns_total', step=step)
+    try:
+        # Stream LLM answers chunk by chunk when the client asks for it
+        if step == "chat" and data.get('stream'):
+            events = stream_bot_response(message, user_id)
+            append_chat_history(user_id, "user", message)
+            session.modified = True
+            return Response(
+                stream_with_context(events),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        with metrics.timer('chat_turn_seconds', step=step):
+            response = handle_patient_info(user_id, step, message)
+    except LLMBusyError:
+        # Nothing is recorded so the client can simply retry
+        metrics.inc('llm_busy_total')
+        return busy_response()
+
+    # Save user message and bot response
+    append_chat_history(user_id, "user", message)
+    append_chat_history(user_id, "bot", response)
     return jsonify({"response": format_response(response)})
 
+@app.route('/chat/intake', methods=['POST'])
+def intake_post():
+    """Take several or all intake answers at once, e.g. from a form on a slow connection.
+
+    Answers are validated together and nothing is stored unless all are valid.
+    The conversation then continues at the first unanswered step.
+    """
+    data = request.get_json()
+    user_id = data.get('user_id', 'default')
+    answers = data.get('answers') or {}
+    if not isinstance(answers, dict):
+        return jsonify({"errors": {"answers": "answers 必須是欄位與回答的對照"}}), 400
+    
+    if user_id not in session:
+        start_conversation(user_id)
+    if session[user_id]['current_step'] not in intake_steps:
+        return jsonify({"errors": {"intake": "已完成基本資料填寫。"}}), 409
+    
+    unknown = [field for field in answers if field not in intake_steps]
+    if unknown:
+        return jsonify({"errors": {field: "未知的欄位" for field in unknown}}), 400
+    
+    metrics.inc('chat_turns_total', step="intake")
+    values, errors = {}, {}
+    for field, message in answers.items():
+        try:
+            values[field] = intake_steps[field]["parse"](str(message))
+        except ValueError as e:
+            errors[field] = str(e)
+    if errors:
+        return jsonify({"errors": errors}), 400
+    
+    info = session[user_id]['patient_info']
+    info.update(values)
+    step = next((field for field in intake_steps if field not in info), "chat")
+    if step == "chat":
+        response = finish_intake(user_id)
+    else:
+        session[user_id]['current_step'] = step
+        session.modified = True
+        response = questions[step]
+    
+    append_chat_history(user_id, "bot", response)
+    return jsonify({"response": format_response(response), "current_step": step})
+
+def start_conversation(user_id):
+    """Create the session state of a new conversation, starting at the first intake step"""
+    session[user_id] = {}
+    session[user_id]['patient_info'] = {}
+    session[user_id]['current_step'] = "name"
+
+def chat_history_key(user_id):
+    """Store key of a conversation's transcript, scoped to the browser session"""
+    return f"chat_history:{session.sid}:{user_id}"
+
+def append_chat_history(user_id, role, message):
+    """Append one turn to the transcript kept in the server-side store"""
+    session_backend.append(chat_history_key(user_id), {"role": role, "message": message}, app.config['SESSION_TTL'])
+
+def get_chat_history(user_id, start=0):
+    """Return the transcript of a conversation, from turn start on"""
+    return session_backend.get_list(chat_history_key(user_id), start)
+
+def busy_response():
+    """Fast 503 telling the client to retry when the LLM pool is saturated"""
+    response = "目前諮詢人數較多，請稍後再試一次。"
+    retry_after = app.config['LLM_RETRY_AFTER']
+    return jsonify({"response": format_response(response), "busy": True}), 503, {'Retry-After': str(retry_after)}
+
 def format_response(response):
     """Convert response to HTML with markdown formatting"""
-    try:
-        # Convert markdown to HTML
-        html_response = markdown(response, extensions=['extra'])
-        
-        # Define allowed HTML tags and attributes
-        allowed_tags = [
-            'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
-            'ul', 'ol', 'li', 'strong', 'em', 'a',
-            'code', 'pre', 'blockquote', 'table', 'thead',
-            'tbody', 'tr', 'th', 'td', 'br', 'hr'
-        ]
-        allowed_attributes = {
-            'a': ['href', 'title'],
-            'img': ['src', 'alt', 'title']
-        }
-        
-        # Clean and sanitize HTML
-        clean_html = bleach.clean(
-            html_response,
-            tags=allowed_tags,
-            attributes=allowed_attributes,
-            strip=True
-        )
-        
-        return clean_html
-    except Exception as e:
-        print(f"Error in format_response: {str(e)}")
-        return response  # Return original response if formatting fails
+    with metrics.timer('format_response_seconds'):
+        try:
+            return render_markdown(response)
+        except Exception as e:
+            logger.warning("format_response failed error=%r", e)
+            return response  # Return original response if formatting fails
 
 def handle_patient_info(user_id, step, message):
     if 'patient_info' not in session[user_id]:
@@ -184,105 +485,43 @@ def handle_patient_info(user_id, step, message):
     
     info = session[user_id]['patient_info']
     
-    if step == "name":
-        if len(message.strip()) < 1:
-            return "請告訴我您的姓名。"
-        info['name'] = message
-        session[user_id]['current_step'] = "age"
-        session.modified = True
-        return "您好，" + message + "！請問您的年齡是？"
-            
-    elif step == "age":
+    if step in intake_steps:
         try:
-            age = int(message.replace("歲", "").strip())
-            if age < 0 or age > 150:
-                return "請輸入有效的年齡（0-150歲）"
-            info['age'] = age
-            session[user_id]['current_step'] = "sex"
-            session.modified = True
-            return "請問您的性別是？（男/女）"
-        except ValueError:
-            return "抱歉，我沒有理解您的年齡，請直接輸入數字，例如：25"
-            
-    elif step == "sex":
-        if message not in ["男", "女"]:
-            return "抱歉，請選擇「男」或「女」" 
-        info['sex'] = message
-        session[user_id]['current_step'] = "operation"
-        session.modified = True
-        return "請問您預計要進行什麼手術？"
-            
-    elif step == "operation":
-        if len(message.strip()) < 1:
-            return "請告訴我您預計要進行的手術。"
-        info['operation'] = message
-        session[user_id]['current_step'] = "cfs"
-        session.modified = True
-        return "您是否能夠自行外出，不需要他人協助？（是/否）"
-            
-    elif step == "cfs":
-        if message.lower() in ["是", "yes", "y", "可以"]:
-            info['cfs'] = "是"
-        else:
-            info['cfs'] = "否"
-        session[user_id]['current_step'] = "medical_history"
-        session.modified = True
-        return "請問您有什麼重要的病史嗎？例如：高血壓、糖尿病、心臟病等。如果沒有，請回答「無」。"
-            
-    elif step == "medical_history":
-        if len(message.strip()) < 1:
-            return "請告訴我您的病史，如果沒有請點選「沒有特殊病史」。"
-        info['medical_history'] = message
-        session[user_id]['current_step'] = "worry"
-        session.modified = True
-        return "您最擔心什麼？您可以點選或輸入您的擔憂。如果沒有特別擔心的，請點選「沒有特別擔心」。"
-            
-    elif step == "worry":
-        if len(message.strip()) < 1:
-            return "請告訴我您的擔憂，如果沒有特別擔心的，請點選「沒有特別擔心」。"
-        info['worry'] = message
+            info[step] = intake_steps[step]["parse"](message)
+        except ValueError as e:
+            return str(e)
         
-        # Save patient data to database
-        print(f"Attempting to save patient data: {info}")  # Debug print
-        try:
-            # Create new patient
-            patient = Patient()
-            patient.name = info.get('name', '')
-            patient.age = info.get('age', 0)
-            patient.sex = info.get('sex', '')
-            patient.operation = info.get('operation', '')
-            patient.cfs = info.get('cfs', '')
-            patient.medical_history = info.get('medical_history', '')
-            patient.worry = info.get('worry', '')
-            
-            # Add and commit
-            print("Adding patient to session...")
-            db.session.add(patient)
-            print("Committing changes...")
-            db.session.commit()
-            print(f"Successfully saved patient with ID: {patient.id}")
-            
-        except Exception as e:
-            print(f"Error saving patient data: {str(e)}")
-            import traceback
-            print(traceback.format_exc())
-            db.session.rollback()
-        
-        session[user_id]['current_step'] = "chat"
+        next_step = intake_steps[step]["next"]
+        if next_step == "chat":
+            return finish_intake(user_id)
+        session[user_id]['current_step'] = next_step
         session.modified = True
-            
-        # Generate summary with markdown formatting
-        summary = generate_summary(info)
-        return summary + "\n\n您可以問我關於麻醉的問題，我會盡力為您解答。"
+        if step == "name":
+            return "您好，" + message + "！" + questions[next_step]
+        return questions[next_step]
             
     elif step == "chat":
-        response = get_bot_response(message, user_id)
-        return format_response(response)
+        # Rendered once, by chat_post
+        return get_bot_response(message, user_id)
             
     else:
         session[user_id]['current_step'] = "name"
         return "抱歉，讓我們重新開始。請告訴我您的姓名。"
 
+def finish_intake(user_id):
+    """Store the patient once every intake answer is in and move on to the chat step"""
+    info = session[user_id]['patient_info']
+    
+    # Bind the conversation to the stored patient; chat and self-pay rows are queued against this id
+    session[user_id]['patient_id'] = save_patient(dict(info))
+    
+    session[user_id]['current_step'] = "chat"
+    session.modified = True
+    
+    # Generate summary with markdown formatting
+    summary = generate_summary(info)
+    return summary + "\n\n您可以問我關於麻醉的問題，我會盡力為您解答。"
+
 def generate_summary(info):
     """Generate a markdown-formatted summary of patient information"""
     summary = "## 您提供的資訊摘要\n\n"
@@ -304,51 +543,17 @@ def generate_summary(info):
         worry = "無特殊擔憂"
     summary += f"* **擔憂**：{worry}"
     
+    recommended = recommend(info)
+    if recommended:
+        summary += "\n\n### 建議自費項目\n\n"
+        for item, reasons in recommended.items():
+            summary += f"* **{ITEMS[item][0]}**：{'、'.join(reasons)}\n"
+    
     return summary
 
-def create_context(message, info):
-    """Create context for Gemini model with patient info and message"""
-    context = f"""## Role: Anesthesia Consultant
-### Skills:
-- 使用繁體中文回答問題
-- 專業解說麻醉相關資訊
-- 使用emoji讓對話更生動
-- 根據問題類型提供針對性回答
-- 提升病人及家屬對麻醉和自費建議的理解
-
-### Goals:
-- 提供清晰易懂的醫療資訊
-- 根據問題類型給予重點回答
-- 使用emoji增添對話趣味性
-
-### Constraints:
-1. 僅討論麻醉相關議題
-2. 避免回答工具和規則相關問題
-3. 根據問題類型聚焦回答重點
-
-### 回答重點指引:
-1. 麻醉類型相關問題:
-   - 聚焦於各種可能的麻醉方式
-   - 解釋各種麻醉方式的優缺點
-   - 根據病人情況建議最適合的麻醉方式
-   - 說明麻醉過程中的感受
-
-2. 術前準備相關問題:
-   - 強調禁食時間要求（固體食物6小時、清水2小時）
-   - 說明需要停用的藥物（如：抗凝血劑）
-   - 建議戒菸時間和重要性
-   - 提醒術前注意事項
-
-3. 麻醉風險相關問題:
-   - 根據病人年齡和病史評估ASA分級
-   - 說明個人化的麻醉風險
-   - 解釋如何透過自費項目降低風險：
-     * 麻醉深度監測：降低術中知曉風險
-     * 最適肌張力：降低肌肉鬆弛劑相關併發症
-     * 體溫監測與保溫：降低低體溫併發症
-     * 止吐藥物：降低噁心嘔吐風險
-
-### 病人資訊:
+def create_patient_context(info):
+    """Create the per-patient block of the prompt; built once per session"""
+    return f"""### 病人資訊:
 - 姓名：{info['name']}
 - 年齡：{info['age']}
 - 性別：{info['sex']}
@@ -356,60 +561,313 @@ def create_context(message, info):
 - 行動能力：{info.get('cfs', '未評估')}
 - 病史：{info.get('medical_history', '無')}
 - 擔憂：{info.get('worry', '無')}
+- 估計ASA分級：{estimate_asa(info)}
+- 依規則建議的自費項目：{'、'.join(ITEMS[item][0] for item in recommend(info)) or '無'}
+"""
 
-### 自費項目建議規則:
-- 年齡>50歲或ASA>2級: 建議使用麻醉深度監測系統和最適肌張力手術輔助處置
-- 擔心疼痛: 建議使用病人自控式止痛
-- 容易暈車或手術>2小時: 建議使用止吐藥和麻醉深度監測系統
-- 怕冷或手術>1小時: 建議使用溫毯並解釋保溫重要性
-- 失眠或精神緊張: 建議使用麻醉深度監測系統
-- 體弱或年長: 建議使用麻醉深度監測系統和最適肌張力手術輔助處置
+AGE_BAND_LABELS = {
+    "child": "未滿18歲",
+    "adult": "18-50歲",
+    "senior": "51-65歲",
+    "elderly": "65歲以上",
+    "unknown": "未提供",
+}
+
+def create_shared_patient_context(info):
+    """Patient block for answers shared through the answer cache.
+
+    It is built only from shared_features, which make up the cache key: no
+    name, the age band instead of the exact age, and the ASA class, worry
+    topics and recommended items instead of the free-text answers, so the
+    answer fits every patient with the same key.
+    """
+    features = shared_features(info)
+    return f"""### 病人資訊:
+- 年齡層：{AGE_BAND_LABELS[features['age_band']]}
+- 性別：{features['sex'] or '未提供'}
+- 預定手術：{features['operation'] or '未提供'}
+- 行動能力：{features['cfs'] or '未評估'}
+- 估計ASA分級：{features['asa']}
+- 擔憂：{'、'.join(WORRY_LABELS[topic] for topic in features['worries']) or '無特別擔憂'}
+- 依規則建議的自費項目：{'、'.join(ITEMS[item][0] for item in features['items']) or '無'}
+"""
+
+def create_context(message, info, patient_context=None, history=""):
+    """Create the per-turn prompt; the static instructions live in SYSTEM_PROMPT"""
+    if patient_context is None:
+        patient_context = create_patient_context(info)
+    if history:
+        patient_context = f"{patient_context}\n{history}\n"
+    return f"""{patient_context}
+病人問題: {message}"""
+
+def get_patient_context(user_id):
+    """Return the cached patient block for this conversation, building it on first use"""
+    if 'patient_context' not in session[user_id]:
+        session[user_id]['patient_context'] = create_patient_context(session[user_id].get('patient_info', {}))
+        session.modified = True
+    return session[user_id]['patient_context']
+
+def get_history_context(user_id):
+    """Return the summary of older turns and the recent turns that fit the context budget.
+
+    Only the transcript after the last summarized turn is read, and turns
+    leaving the verbatim window are summarized once and kept in the session.
+    """
+    state = session[user_id].get('history')
+    if state is None:
+        # Everything before the first question is intake, which the patient block covers
+        state = session[user_id]['history'] = {"offset": len(get_chat_history(user_id)), "summary": []}
+    recent, folded = fold_history(
+        get_chat_history(user_id, state["offset"]),
+        state["summary"],
+        app.config['CONTEXT_HISTORY_TOKENS'],
+        app.config['CONTEXT_SUMMARY_TOKENS']
+    )
+    state["offset"] += folded
+    session.modified = True
+    return state["summary"], recent
+
+def log_llm_usage(kind, response, started):
+    """Record latency and prompt/output token counts of a Gemini call"""
+    elapsed = time.perf_counter() - started
+    metrics.observe('llm_request_seconds', elapsed, kind=kind)
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+    output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+    metrics.inc('llm_tokens_total', prompt_tokens, kind=kind, direction='prompt')
+    metrics.inc('llm_tokens_total', output_tokens, kind=kind, direction='output')
+    logger.info("llm_call kind=%s ms=%.0f prompt_tokens=%d output_tokens=%d",
+                kind, elapsed * 1000, prompt_tokens, output_tokens)
+
+def get_cached_answer(message, info):
+    """Return the shared answer for this question and patient features, or None"""
+    response = answer_cache.get(make_key(message, info))
+    metrics.inc('answer_cache_requests_total', result='miss' if response is None else 'hit')
+    return response
+
+def cache_answer(message, info, response):
+    """Share an answer that was generated from create_shared_patient_context"""
+    answer_cache.set(make_key(message, info), response)
+
+# The quick-question buttons in templates/index.html; they are offered again after
+# every answer, so they are answered without the conversation and shared on any turn
+SHARED_QUESTIONS = {normalize_text(question) for question in (
+    '這個手術需要什麼類型的麻醉？',
+    '麻醉前需要做什麼準備？',
+    '麻醉有什麼風險？',
+    '如何減輕我擔心的問題？',
+    '根據我的身體狀況，有什麼特別需要注意的事項？',
+)}
+
+def is_shared_turn(message, summary, recent):
+    """Whether this turn is answered from the shareable patient block, and so can use the answer cache"""
+    return (not summary and not recent) or normalize_text(message) in SHARED_QUESTIONS
 
-病人問題: {message}
+def turn_context(message, info, user_id, summary, recent, shared):
+    """Prompt for this turn; shared turns get the shareable patient block and no history"""
+    if shared:
+        return create_context(message, info, create_shared_patient_context(info))
+    return create_context(message, info, get_patient_context(user_id), format_history(summary, recent))
 
-請根據以上資訊，提供專業且易懂的回答。使用markdown格式並加入適當的emoji增添親和力。回答時請依據問題類型(麻醉類型/術前準備/麻醉風險)聚焦於相關重點。"""
-    return context
+def save_patient(info):
+    """Insert a new patient and return the id the database assigned.
+
+    Written synchronously, not through the write-behind queue, so the row
+    exists before any chat or self-pay row refers to it.
+    """
+    patient = Patient()
+    patient.name = info.get('name', '')
+    patient.age = info.get('age', 0)
+    patient.sex = info.get('sex', '')
+    patient.operation = info.get('operation', '')
+    patient.cfs = info.get('cfs', '')
+    patient.medical_history = info.get('medical_history', '')
+    patient.worry = info.get('worry', '')
+    db.session.add(patient)
+    db.session.flush()
+    patient_id = patient.id
+    increment_daily_count(patient.created_at.date())
+    db.session.commit()
+    logger.debug("patient_saved id=%s", patient_id)
+    return patient_id
+
+def save_chat_history(patient_id, message, response):
+    """Queue a user message and bot response for the conversation's patient"""
+    if patient_id is None:
+        return
+    def job():
+        # Save both user message and bot response
+        user_msg = ChatHistory(
+            patient_id=patient_id,
+            message=message,
+            response=None,
+            message_type='user'
+        )
+        bot_msg = ChatHistory(
+            patient_id=patient_id,
+            message=None,
+            response=response,
+            message_type='bot'
+        )
+        db.session.add(user_msg)
+        db.session.add(bot_msg)
+    write_queue.enqueue(job)
+
+# Keywords that pick the anesthesia_info entries a fallback answer shows
+FALLBACK_KEYWORDS = {
+    "全身麻醉": ("全身", "全麻", "睡著", "醒"),
+    "區域麻醉": ("區域", "半身", "局部", "脊椎", "硬膜"),
+}
+
+def degraded_answer(message):
+    """Answer from the static anesthesia_info while the LLM is unavailable"""
+    topics = [topic for topic, words in FALLBACK_KEYWORDS.items() if any(word in message for word in words)]
+    sections = ["抱歉，AI 諮詢目前暫時無法使用，以下是一般麻醉資訊供您參考："]
+    for topic in topics or anesthesia_info:
+        details = anesthesia_info[topic]
+        preparation = "\n".join(f"* {item}" for item in details["準備事項"])
+        sections.append(f"### {topic}\n{details['描述']}\n\n{preparation}")
+    sections.append("如有其他疑問，請稍後再試，或直接詢問您的麻醉醫師。")
+    return "\n\n".join(sections)
 
 def get_bot_response(message, user_id):
     info = session[user_id].get('patient_info', {})
     
-    # Create context for the model
-    context = create_context(message, info)
+    # Create context for the model, with the conversation so far
+    summary, recent = get_history_context(user_id)
+    # Follow-up questions depend on the conversation, so only opening and quick questions share cached answers
+    cacheable = is_shared_turn(message, summary, recent)
+    context = turn_context(message, info, user_id, summary, recent, cacheable)
     
     try:
-        # Get response from API
-        response = model.generate_content(context).text
+        # Answer repeated questions from the cache
+        response = get_cached_answer(message, info) if cacheable else None
         
-        # Save to database if we have a patient
-        try:
-            # Find the patient by name and created_at (most recent)
-            patient = Patient.query.filter_by(name=info.get('name')).order_by(Patient.created_at.desc()).first()
-            if patient:
-                # Save both user message and bot response
-                user_msg = ChatHistory(
-                    patient_id=patient.id,
-                    message=message,
-                    response=None,
-                    message_type='user'
-                )
-                bot_msg = ChatHistory(
-                    patient_id=patient.id,
-                    message=None,
-                    response=response,
-                    message_type='bot'
-                )
-                db.session.add(user_msg)
-                db.session.add(bot_msg)
-                db.session.commit()
-                print(f"Saved chat history for patient {patient.name}")
-        except Exception as e:
-            print(f"Error saving chat history: {str(e)}")
-            db.session.rollback()
+        # Don't wait on the pool for an upstream that is known to be down
+        if response is None and not resilient_llm.available():
+            metrics.inc('llm_fallback_total', reason='circuit_open')
+            response = degraded_answer(message)
         
-        return response
+        if response is None:
+            # Get response from API on the bounded LLM pool
+            started = time.perf_counter()
+            result = llm_executor.call(generate_content, context)
+            response = result.text
+            log_llm_usage("generate", result, started)
+            if not response:
+                # e.g. every candidate was blocked by the safety filters
+                metrics.inc('llm_fallback_total', reason='empty')
+                response = degraded_answer(message)
+            elif cacheable:
+                cache_answer(message, info, response)
+    except LLMBusyError:
+        raise
+    except CircuitOpenError:
+        metrics.inc('llm_fallback_total', reason='circuit_open')
+        response = degraded_answer(message)
     except Exception as e:
-        print(f"Error getting API response: {str(e)}")
-        return "抱歉，我現在無法回答您的問題。請稍後再試。"
+        metrics.inc('llm_errors_total', kind='generate')
+        metrics.inc('llm_fallback_total', reason='error')
+        logger.warning("llm_call failed kind=generate error=%r", e)
+        response = degraded_answer(message)
+    
+    # Save every answer the patient was shown, fallbacks included, like the streaming path
+    save_chat_history(session[user_id].get('patient_id'), message, response)
+    return response
+
+def sse_event(payload):
+    """Encode a payload as a server-sent event"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_bot_response(message, user_id):
+    """Start a Gemini stream on the LLM pool and return its server-sent events.
+
+    Raises LLMBusyError up front when the pool is full.
+    """
+    info = session[user_id].get('patient_info', {})
+    summary, recent = get_history_context(user_id)
+    cacheable = is_shared_turn(message, summary, recent)
+    cached = get_cached_answer(message, info) if cacheable else None
+    if cached is not None:
+        return render_cached(cached, info, message, user_id)
+    
+    if not resilient_llm.available():
+        metrics.inc('llm_fallback_total', reason='circuit_open')
+        return render_cached(degraded_answer(message), info, message, user_id)
+    
+    context = turn_context(message, info, user_id, summary, recent, cacheable)
+    started = time.perf_counter()
+    chunks = llm_executor.stream(generate_content, context, stream=True)
+    return render_stream(chunks, info, message, user_id, started, cacheable)
+
+# Minimum seconds between two renders of a streaming answer
+STREAM_RENDER_INTERVAL = 0.1
+
+def render_cached(response, info, message, user_id):
+    """Send a complete answer (cached or fallback) as a single event"""
+    yield sse_event({"response": format_response(response)})
+    append_chat_history(user_id, "bot", response)
+    save_chat_history(session[user_id].get('patient_id'), message, response)
+    yield sse_event({"done": True})
+
+def render_stream(chunks, info, message, user_id, started, cacheable=True):
+    """Render markdown as chunks arrive and yield each step as an event.
+
+    Blocks that are finished (followed by a blank line) are rendered once
+    and sent as "append"; only the open block after them is re-rendered
+    and sent as "tail". Chunks arriving within STREAM_RENDER_INTERVAL of the
+    last render are folded into the next one. The complete answer is
+    rendered once more at the end, as "response", so markdown that spans
+    blocks (e.g. a loose numbered list) comes out right.
+    """
+    response = ""
+    done = 0  # Characters of response already sent as finished blocks
+    last_render = 0.0
+    chunk = None
+    complete = False
+    try:
+        for chunk in chunks:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata only)
+                continue
+            if not text:
+                continue
+            response += text
+            if time.perf_counter() - last_render >= STREAM_RENDER_INTERVAL:
+                event = {}
+                finished = done + finished_length(response[done:])
+                if finished > done:
+                    event["append"] = format_response(response[done:finished])
+                    done = finished
+                event["tail"] = format_response(response[done:])
+                yield sse_event(event)
+                last_render = time.perf_counter()
+        complete = bool(response)
+        if not complete:
+            # The stream ended without text, e.g. every chunk was blocked by the safety filters
+            metrics.inc('llm_fallback_total', reason='empty')
+            response = degraded_answer(message)
+    except Exception as e:
+        if not isinstance(e, CircuitOpenError):
+            metrics.inc('llm_errors_total', kind='stream')
+            logger.warning("llm_call failed kind=stream error=%r", e)
+        if not response:
+            metrics.inc('llm_fallback_total', reason='circuit_open' if isinstance(e, CircuitOpenError) else 'error')
+            response = degraded_answer(message)
+    yield sse_event({"response": format_response(response)})
+    
+    # The last chunk carries the usage totals for the whole stream
+    log_llm_usage("stream", chunk, started)
+    if complete and cacheable:
+        cache_answer(message, info, response)
+    
+    # Persist the complete answer once the stream ends
+    append_chat_history(user_id, "bot", response)
+    save_chat_history(session[user_id].get('patient_id'), message, response)
+    yield sse_event({"done": True})
 
 @app.route('/self_pay')
 def self_pay():
@@ -423,6 +881,7 @@ def self_pay():
     
     return render_template('self_pay_form.html', 
                          patient_info=user_info,
+                         recommended=recommend(user_info),
                          user_id=user_id)
 
 @app.route('/submit_self_pay', methods=['POST'])
@@ -431,16 +890,22 @@ def submit_self_pay():
     user_id = data.get('user_id')
     selected_items = data.get('selected_items', [])
     
-    patient = Patient.query.get(user_id)
-    if patient:
-        for item in selected_items:
+    # user_id is the client's conversation id; the patient is the one bound to it at intake
+    patient_id = session.get(user_id, {}).get('patient_id')
+    if patient_id is None:
+        return jsonify({'status': 'error', 'message': '找不到病人資料，請先完成諮詢。'}), 404
+    
+    items = [(item['name'], float(item['price'])) for item in selected_items]
+    
+    def job():
+        for name, price in items:
             self_pay_item = SelfPayItem(
-                patient_id=user_id,
-                item_name=item['name'],
-                price=float(item['price'])
+                patient_id=patient_id,
+                item_name=name,
+                price=price
             )
             db.session.add(self_pay_item)
-        db.session.commit()
+    write_queue.enqueue(job)
     
     return jsonify({'status': 'success'})
 
@@ -460,14 +925,21 @@ def login():
 @login_required
 def admin_dashboard():
     today = datetime.utcnow().date()
+    today_start = datetime.combine(today, datetime.min.time())
+    
+    # Half-open range on the indexed column only touches today's rows
     today_count = Patient.query.filter(
-        db.func.date(Patient.created_at) == today
+        Patient.created_at >= today_start,
+        Patient.created_at < today_start + timedelta(days=1)
     ).count()
     
+    # Earlier days of the month come from the rollup, at most 30 rows
     month_start = today.replace(day=1)
-    month_count = Patient.query.filter(
-        Patient.created_at >= month_start
-    ).count()
+    earlier_count = db.session.query(db.func.sum(PatientDailyCount.count)).filter(
+        PatientDailyCount.day >= month_start,
+        PatientDailyCount.day < today
+    ).scalar() or 0
+    month_count = earlier_count + today_count
     
     patients = Patient.query.order_by(Patient.created_at.desc()).limit(50).all()
     
@@ -476,11 +948,206 @@ def admin_dashboard():
                          month_count=month_count,
                          patients=patients)
 
+def encode_cursor(row):
+    """Opaque keyset cursor pointing just past a patient or chat row"""
+    raw = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Return (created_at, id) from a cursor, raising ValueError if malformed"""
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+def parse_patient_filters(args):
+    """Read list filters from query parameters, raising ValueError on bad input"""
+    filters = {}
+    if args.get('date_from'):
+        filters['date_from'] = datetime.strptime(args['date_from'], '%Y-%m-%d')
+    if args.get('date_to'):
+        # date_to is inclusive; query up to the start of the next day
+        filters['date_to'] = datetime.strptime(args['date_to'], '%Y-%m-%d') + timedelta(days=1)
+    if args.get('sex'):
+        if args['sex'] not in ["男", "女"]:
+            raise ValueError("sex must be 男 or 女")
+        filters['sex'] = args['sex']
+    if args.get('age_min'):
+        filters['age_min'] = int(args['age_min'])
+    if args.get('age_max'):
+        filters['age_max'] = int(args['age_max'])
+    if args.get('operation', '').strip():
+        filters['operation'] = args['operation'].strip()
+    return filters
+
+def query_patient_page(filters, cursor=None, limit=50):
+    """Return one page of patients, newest first, and the cursor of the next page.
+
+    Pages are found by keyset on (created_at, id) rather than OFFSET, so a
+    page deep in history costs the same as the first one.
+    """
+    query = Patient.query
+    if 'date_from' in filters:
+        query = query.filter(Patient.created_at >= filters['date_from'])
+    if 'date_to' in filters:
+        query = query.filter(Patient.created_at < filters['date_to'])
+    if 'sex' in filters:
+        query = query.filter(Patient.sex == filters['sex'])
+    if 'age_min' in filters:
+        query = query.filter(Patient.age >= filters['age_min'])
+    if 'age_max' in filters:
+        query = query.filter(Patient.age <= filters['age_max'])
+    if 'operation' in filters:
+        query = query.filter(Patient.operation.contains(filters['operation'], autoescape=True))
+    
+    if cursor:
+        created_at, patient_id = decode_cursor(cursor)
+        # The plain <= bound lets SQLite seek the created_at index; the OR alone would scan
+        query = query.filter(
+            Patient.created_at <= created_at,
+            db.or_(Patient.created_at < created_at, Patient.id < patient_id)
+        )
+    
+    # Fetch one extra row to know whether another page exists
+    patients = query.order_by(Patient.created_at.desc(), Patient.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(patients[limit - 1]) if len(patients) > limit else None
+    return patients[:limit], next_cursor
+
+def patient_page_from_request():
+    """Run query_patient_page with the current request's parameters"""
+    try:
+        filters = parse_patient_filters(request.args)
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        patients, next_cursor = query_patient_page(filters, request.args.get('cursor'), limit)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return patients, next_cursor
+
+@app.route('/admin/patients')
+@login_required
+def patient_list():
+    patients, next_cursor = patient_page_from_request()
+    # Keep the filters when following the next-page link
+    args = {key: value for key, value in request.args.items() if key != 'cursor'}
+    return render_template('patient_list.html',
+                         patients=patients,
+                         next_cursor=next_cursor,
+                         filters=args)
+
+@app.route('/admin/api/patients')
+@login_required
+def patient_list_api():
+    patients, next_cursor = patient_page_from_request()
+    return jsonify({
+        'patients': [{
+            'id': patient.id,
+            'name': patient.name,
+            'age': patient.age,
+            'sex': patient.sex,
+            'operation': patient.operation,
+            'created_at': patient.created_at.isoformat()
+        } for patient in patients],
+        'next_cursor': next_cursor
+    })
+
 @app.route('/admin/patient/<id>')
 @login_required
 def patient_detail(id):
-    patient = Patient.query.get_or_404(id)
-    return render_template('patient_detail.html', patient=patient)
+    # Self-pay items come in one extra SELECT ... IN query instead of a lazy load
+    patient = Patient.query.options(db.selectinload(Patient.self_pay_items)).get_or_404(id)
+    chats, next_cursor = query_chat_page(patient.id)
+    return render_template('patient_detail.html',
+                         patient=patient,
+                         chats=chats,
+                         next_cursor=next_cursor)
+
+def query_chat_page(patient_id, cursor=None, limit=50):
+    """Return one page of a patient's chat turns, oldest first, and the next cursor.
+
+    Uses the (patient_id, created_at) index, so a transcript of thousands of
+    turns opens as fast as a short one.
+    """
+    query = ChatHistory.query.filter(ChatHistory.patient_id == patient_id)
+    if cursor:
+        created_at, chat_id = decode_cursor(cursor)
+        query = query.filter(
+            ChatHistory.created_at >= created_at,
+            db.or_(ChatHistory.created_at > created_at, ChatHistory.id > chat_id)
+        )
+    chats = query.order_by(ChatHistory.created_at, ChatHistory.id).limit(limit + 1).all()
+    next_cursor = encode_cursor(chats[limit - 1]) if len(chats) > limit else None
+    return chats[:limit], next_cursor
+
+@app.route('/admin/api/patient/<id>/chats')
+@login_required
+def patient_chats_api(id):
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        chats, next_cursor = query_chat_page(int(id), request.args.get('cursor'), limit)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return jsonify({
+        'chats': [{
+            'id': chat.id,
+            'message_type': chat.message_type,
+            'content': chat.message if chat.message_type == 'user' else chat.response,
+            'created_at': chat.created_at.strftime('%Y-%m-%d %H:%M')
+        } for chat in chats],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/admin/export/<table>.<fmt>')
+@login_required
+def export_table(table, fmt):
+    try:
+        start, end = export.parse_date_range(request.args.get('date_from'), request.args.get('date_to'))
+        chunks = export.export(table, fmt, start, end)
+    except ValueError as e:
+        abort(400, description=str(e))
+    except RuntimeError as e:
+        abort(501, description=str(e))
+    return Response(
+        stream_with_context(chunks),
+        mimetype=export.FORMATS[fmt][0],
+        headers={'Content-Disposition': f'attachment; filename={table}.{fmt}'}
+    )
+
+@app.route('/admin/api/recommendations')
+@login_required
+def recommendation_report():
+    """Self-pay recommendations and potential revenue over all patients in a date range"""
+    try:
+        start, end = export.parse_date_range(request.args.get('date_from'), request.args.get('date_to'))
+    except ValueError as e:
+        abort(400, description=str(e))
+    rows = (row for batch in export.export_rows('patients', start, end) for row in batch)
+    return jsonify(score_patients(rows))
+
+@app.route('/admin/api/analytics')
+@login_required
+def analytics_report():
+    """Operation mix, age bands, self-pay uptake and revenue per item over a date range"""
+    try:
+        first, last, bucket, top = parse_report_args(request.args)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return jsonify(analytics_cache.report(first, last, bucket, top))
+
+@app.route('/admin/analytics_stats')
+@login_required
+def analytics_stats():
+    return jsonify(analytics_cache.stats())
+
+@app.route('/admin/cache_stats')
+@login_required
+def cache_stats():
+    return jsonify(answer_cache.stats())
+
+@app.route('/admin/write_queue_stats')
+@login_required
+def write_queue_stats():
+    return jsonify(write_queue.stats())
 
 @app.route('/logout')
 @login_required
@@ -488,5 +1155,41 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
+_database_ready = False
+_database_lock = threading.Lock()
+
+def init_database():
+    """Create missing tables and apply pending migrations, once per process"""
+    global _database_ready
+    if _database_ready:
+        return
+    with _database_lock:
+        if _database_ready:
+            return
+        with app.app_context():
+            db.create_all()
+            migrate()
+            logger.info("database ready url=%s", db.engine.url.render_as_string(hide_password=True))
+            db.session.remove()
+            # Don't keep the setup connections pooled; a preloading master would fork them into every worker
+            db.engine.dispose()
+        _database_ready = True
+
+# Entry points that use the module-level app directly (flask run, gunicorn app:app)
+# still get the schema prepared before their first query
+@app.before_first_request
+def prepare_database():
+    init_database()
+
+def create_app():
+    """Application factory for servers, e.g. gunicorn 'app:create_app()'.
+
+    Importing this module only builds the app; the schema is prepared here,
+    or before the first request when the module-level app is served directly,
+    and the LLM client on the first question.
+    """
+    init_database()
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""Time the admin analytics report over a year of data: cold, cached and after new rows.
+
+Usage: python benchmarks/analytics.py [--sizes 10000,100000,1000000] [--uptake 0.4] [--runs 5]
+
+Each size gets a fresh SQLite file with synthetic patients spread over the
+last year and self-pay selections for a share of them, on the migrated
+schema. "cold" fills the day cache from SQL, "cached" repeats the report,
+and "refresh" adds 100 patients with selections today so the next report
+recomputes only the changed day.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from models import db, Patient, SelfPayItem
+from migrations import migrate
+from analytics import AnalyticsCache
+
+OPERATIONS = ['膝關節置換', '膽囊切除', '白內障', '剖腹產', '脊椎手術', '甲狀腺切除']
+ITEMS = [('麻醉深度監測', 1711.0), ('自控式止痛', 6500.0), ('溫毯', 980.0), ('止吐藥', 99.0)]
+
+
+def create_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def rows(ids, rng, now, uptake, spread):
+    patients, items = [], []
+    # Ids follow creation time, as autoincrement ids do in production
+    times = sorted(now - timedelta(seconds=rng.randint(0, spread)) for _ in ids)
+    for i, created in zip(ids, times):
+        patients.append({'id': i, 'name': f'病人{i % 5000}', 'age': rng.randint(18, 95), 'sex': rng.choice('男女'),
+                         'operation': rng.choice(OPERATIONS), 'created_at': created})
+        if rng.random() < uptake:
+            for name, price in rng.sample(ITEMS, rng.randint(1, 3)):
+                items.append({'patient_id': i, 'item_name': name, 'price': price, 'selected_at': created})
+    return patients, items
+
+
+def load(size, uptake):
+    now = datetime.utcnow()
+    rng = random.Random(size)
+    batch = 50000
+    for start in range(1, size + 1, batch):
+        # Consecutive slices of the year, oldest first
+        offset = 365 * 24 * 3600 * (size - start + 1) // size
+        span = 365 * 24 * 3600 * min(batch, size - start + 1) // size
+        patients, items = rows(range(start, min(start + batch, size + 1)), rng,
+                               now - timedelta(seconds=offset - span), uptake, span)
+        db.session.execute(Patient.__table__.insert(), patients)
+        if items:
+            db.session.execute(SelfPayItem.__table__.insert(), items)
+        db.session.commit()
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--uptake', type=float, default=0.4, help='share of patients with self-pay selections')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'patients':>10} {'cold ms':>10} {'cached ms':>10} {'refresh ms':>11}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            app = create_app(os.path.join(tmp, 'analytics.db'))
+            with app.app_context():
+                db.create_all()
+                migrate()
+                load(size, args.uptake)
+                today = datetime.utcnow().date()
+                first = today - timedelta(days=364)
+
+                cache = AnalyticsCache(refresh_interval=0)
+                started = time.perf_counter()
+                cache.report(first, today, 'month')
+                cold = (time.perf_counter() - started) * 1000
+                cached = timed(lambda: cache.report(first, today, 'month'), args.runs)
+
+                next_id = [size + 1]
+                rng = random.Random(0)
+
+                def add_and_report():
+                    ids = range(next_id[0], next_id[0] + 100)
+                    next_id[0] += 100
+                    patients, items = rows(ids, rng, datetime.utcnow(), args.uptake, 60)
+                    db.session.execute(Patient.__table__.insert(), patients)
+                    db.session.execute(SelfPayItem.__table__.insert(), items)
+                    db.session.commit()
+                    started = time.perf_counter()
+                    cache.report(first, today, 'month')
+                    return (time.perf_counter() - started) * 1000
+
+                refresh = statistics.median(add_and_report() for _ in range(args.runs))
+            print(f"{size:>10} {cold:>10.1f} {cached:>10.1f} {refresh:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
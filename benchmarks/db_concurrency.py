@@ -0,0 +1,136 @@
+"""Compare SQLite under concurrent writers and readers with default and tuned settings.
+
+Usage: python benchmarks/db_concurrency.py [--writers 4] [--readers 4] [--seconds 10] [--busy-timeout 1000]
+
+Each mode gets a fresh SQLite file seeded with patients. Writer processes
+insert patients one transaction at a time, the way the write-behind queue
+commits, while reader processes run the dashboard and patient list queries.
+"default" is the old configuration: rollback journal, synchronous=FULL and a
+new connection per checkout. "tuned" goes through db_config.py. Both modes
+use the same busy timeout so only the journaling and pool settings differ.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+from models import db, Patient, PatientDailyCount, increment_daily_count
+from db_config import configure_database, tune_engine
+
+
+def create_app(path, mode, busy_timeout):
+    app = Flask(__name__)
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ['SQLITE_BUSY_TIMEOUT'] = str(busy_timeout)
+    configure_database(app)
+    if mode == 'default':
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': busy_timeout / 1000}}
+    db.init_app(app)
+    with app.app_context():
+        if mode == 'tuned':
+            tune_engine(db.engine, app.config)
+    return app
+
+
+def seed(path, mode, busy_timeout, size=20000):
+    app = create_app(path, mode, busy_timeout)
+    with app.app_context():
+        db.create_all()
+        now = datetime.utcnow()
+        db.session.execute(Patient.__table__.insert(), [
+            {'id': i, 'name': f'病人{i}', 'age': 40, 'sex': '男', 'operation': '膽囊切除',
+             'created_at': now - timedelta(minutes=i)}
+            for i in range(1, size + 1)
+        ])
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+
+
+def write_patient():
+    patient = Patient(name='病人', age=50, sex='女', operation='白內障')
+    db.session.add(patient)
+    increment_daily_count(datetime.utcnow().date())
+    db.session.commit()
+
+
+def read_dashboard():
+    today = datetime.utcnow().date()
+    today_start = datetime.combine(today, datetime.min.time())
+    Patient.query.filter(Patient.created_at >= today_start,
+                         Patient.created_at < today_start + timedelta(days=1)).count()
+    db.session.query(db.func.sum(PatientDailyCount.count)).filter(
+        PatientDailyCount.day >= today.replace(day=1), PatientDailyCount.day < today).scalar()
+    Patient.query.order_by(Patient.created_at.desc(), Patient.id.desc()).limit(50).all()
+    db.session.commit()
+
+
+def worker(path, mode, busy_timeout, role, seconds, results):
+    app = create_app(path, mode, busy_timeout)
+    operation = write_patient if role == 'writer' else read_dashboard
+    done, locked = 0, 0
+    with app.app_context():
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            try:
+                operation()
+                done += 1
+            except OperationalError as e:
+                db.session.rollback()
+                if 'locked' not in str(e):
+                    raise
+                locked += 1
+            finally:
+                db.session.remove()
+    results.put((role, done, locked))
+
+
+def run(mode, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        seed(path, mode, args.busy_timeout)
+        results = multiprocessing.Queue()
+        roles = ['writer'] * args.writers + ['reader'] * args.readers
+        processes = [
+            multiprocessing.Process(target=worker, args=(path, mode, args.busy_timeout, role, args.seconds, results))
+            for role in roles
+        ]
+        for process in processes:
+            process.start()
+        totals = {'writer': [0, 0], 'reader': [0, 0]}
+        for _ in processes:
+            role, done, locked = results.get()
+            totals[role][0] += done
+            totals[role][1] += locked
+        for process in processes:
+            process.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--busy-timeout', type=int, default=1000, help='milliseconds, both modes')
+    args = parser.parse_args()
+
+    print(f"{'mode':<8} {'writes/s':>10} {'reads/s':>10} {'locked (w/r)':>14}")
+    for mode in ('default', 'tuned'):
+        totals = run(mode, args)
+        writes, write_locked = totals['writer']
+        reads, read_locked = totals['reader']
+        print(f"{mode:<8} {writes / args.seconds:>10.1f} {reads / args.seconds:>10.1f} "
+              f"{f'{write_locked}/{read_locked}':>14}")
+
+
+if __name__ == '__main__':
+    main()
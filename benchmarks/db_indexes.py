@@ -0,0 +1,143 @@
+"""Time dashboard, patient detail and patient list queries before and after the index migration.
+
+Usage: python benchmarks/db_indexes.py [--sizes 10000,100000,1000000] [--chats 2]
+
+Each size gets a fresh SQLite file with synthetic patients, self-pay items
+and chat turns. The list query is a keyset page 90% of the way into
+history. Queries are timed on the baseline schema (no indexes),
+then migrations.migrate() is applied and the same queries are timed again.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import text
+
+from models import db, Patient, SelfPayItem, ChatHistory, PatientDailyCount
+from migrations import migrate, MIGRATIONS
+
+INDEXES = [
+    'ix_patient_created_at',
+    'ix_patient_name',
+    'ix_self_pay_item_patient_id',
+    'ix_chat_history_patient_id_created_at',
+]
+
+
+def create_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def load(size, chats_per_patient):
+    """Bulk-insert synthetic rows on the baseline schema"""
+    for name in INDEXES:
+        db.session.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    now = datetime.utcnow()
+    rng = random.Random(size)
+    batch = 50000
+    for start in range(1, size + 1, batch):
+        ids = range(start, min(start + batch, size + 1))
+        created = {i: now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)) for i in ids}
+        db.session.execute(Patient.__table__.insert(), [
+            {'id': i, 'name': f'病人{i % 5000}', 'age': rng.randint(18, 90), 'sex': rng.choice('男女'),
+             'operation': rng.choice(['膝關節置換', '膽囊切除', '白內障', '剖腹產']), 'cfs': '是',
+             'medical_history': '無', 'worry': '無', 'created_at': created[i]}
+            for i in ids
+        ])
+        db.session.execute(SelfPayItem.__table__.insert(), [
+            {'patient_id': i, 'item_name': '溫毯', 'price': 980.0, 'selected_at': created[i]}
+            for i in ids
+        ])
+        if chats_per_patient:
+            db.session.execute(ChatHistory.__table__.insert(), [
+                {'patient_id': i, 'message': '麻醉有什麼風險？', 'response': None,
+                 'message_type': 'user', 'created_at': created[i] + timedelta(minutes=n)}
+                for i in ids for n in range(chats_per_patient)
+            ])
+        db.session.commit()
+
+
+def dashboard():
+    today = datetime.utcnow().date()
+    today_start = datetime.combine(today, datetime.min.time())
+    Patient.query.filter(Patient.created_at >= today_start,
+                         Patient.created_at < today_start + timedelta(days=1)).count()
+    db.session.query(db.func.sum(PatientDailyCount.count)).filter(
+        PatientDailyCount.day >= today.replace(day=1), PatientDailyCount.day < today).scalar()
+    Patient.query.order_by(Patient.created_at.desc()).limit(50).all()
+
+
+def detail(patient_id):
+    def run():
+        db.session.get(Patient, patient_id)
+        SelfPayItem.query.filter_by(patient_id=patient_id).all()
+        ChatHistory.query.filter_by(patient_id=patient_id).order_by(
+            ChatHistory.created_at, ChatHistory.id).limit(51).all()
+    return run
+
+
+def patient_page(depth):
+    """Keyset page of the admin patient list starting depth rows into history"""
+    def run():
+        created_at, patient_id = cursor
+        Patient.query.filter(
+            Patient.created_at <= created_at,
+            db.or_(Patient.created_at < created_at, Patient.id < patient_id)
+        ).order_by(Patient.created_at.desc(), Patient.id.desc()).limit(51).all()
+    row = db.session.query(Patient.created_at, Patient.id).order_by(
+        Patient.created_at.desc(), Patient.id.desc()).offset(depth).first()
+    cursor = (row.created_at, row.id)
+    return run
+
+
+def timed(fn, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--chats', type=int, default=2, help='chat turns per patient')
+    args = parser.parse_args()
+
+    print(f"{'patients':>10} {'query':<10} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            app = create_app(os.path.join(tmp, 'bench.db'))
+            with app.app_context():
+                db.create_all()
+                load(size, args.chats)
+                queries = [('dashboard', dashboard), ('detail', detail(size // 2)),
+                           ('list', patient_page(size * 9 // 10))]
+                before = {name: timed(fn) for name, fn in queries}
+                migrate()
+                db.session.execute(text('ANALYZE'))
+                after = {name: timed(fn) for name, fn in queries}
+                for name, _ in queries:
+                    print(f"{size:>10} {name:<10} {before[name]:>10.2f} {after[name]:>10.2f} "
+                          f"{before[name] / after[name]:>7.1f}x")
+                db.session.remove()
+                db.engine.dispose()
+    print(f"Migrations applied: {', '.join(str(version) for version, _, _ in MIGRATIONS)}")
+
+
+if __name__ == '__main__':
+    main()
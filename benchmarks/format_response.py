@@ -0,0 +1,117 @@
+"""Time markdown rendering and sanitizing of bot responses.
+
+Usage: python benchmarks/format_response.py [--repeat 200]
+
+"before" is the old format_response: a fresh markdown() call and a
+bleach.clean() with the allow-lists rebuilt on every call. "after" is
+rendering.render_markdown. The chat step used to run it twice per answer,
+which is shown as a separate column.
+
+The second table is the CPU to stream the 8k answer with a given number of
+renders: "whole" re-renders everything received so far each time,
+"blocks" renders finished blocks once and re-renders only the open tail,
+plus one full render at the end, as render_stream does.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bleach
+from markdown import markdown
+
+from rendering import render_markdown, finished_length
+
+STATIC = "請問您有什麼重要的病史嗎？例如：高血壓、糖尿病、心臟病等。如果沒有，請回答「無」。"
+
+SECTION = """## 麻醉風險說明 😊
+
+根據您的年齡和病史，您的 **ASA 分級** 大約是第二級。以下是需要注意的地方：
+
+* 手術前 **6 小時** 禁食固體食物，**2 小時** 禁喝清水
+* 抗凝血劑需要依照醫師指示提前停用
+* 建議手術前至少兩週戒菸
+
+| 自費項目 | 好處 |
+| --- | --- |
+| 麻醉深度監測 | 降低術中知曉風險 |
+| 溫毯 | 降低低體溫併發症 |
+
+> 如果有任何不舒服，請隨時告訴醫護人員。
+
+"""
+
+# A typical answer, a few hundred tokens
+TYPICAL = SECTION * 3
+# About 8k tokens, the longest answer the model is configured to produce
+LONG = SECTION * 40
+
+
+def old_format_response(response):
+    html_response = markdown(response, extensions=['extra'])
+    allowed_tags = [
+        'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+        'ul', 'ol', 'li', 'strong', 'em', 'a',
+        'code', 'pre', 'blockquote', 'table', 'thead',
+        'tbody', 'tr', 'th', 'td', 'br', 'hr'
+    ]
+    allowed_attributes = {
+        'a': ['href', 'title'],
+        'img': ['src', 'alt', 'title']
+    }
+    return bleach.clean(html_response, tags=allowed_tags, attributes=allowed_attributes, strip=True)
+
+
+def timed(fn, text, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(text)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def stream_whole(text, renders):
+    step = len(text) // renders + 1
+    for end in range(step, len(text) + step, step):
+        render_markdown(text[:end])
+
+
+def stream_blocks(text, renders):
+    step = len(text) // renders + 1
+    done = 0
+    for end in range(step, len(text) + step, step):
+        received = text[:end]
+        finished = done + finished_length(received[done:])
+        if finished > done:
+            render_markdown(received[done:finished])
+            done = finished
+        render_markdown(received[done:])
+    render_markdown(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'response':<10} {'chars':>7} {'before ms':>10} {'before x2 ms':>13} {'after ms':>9}")
+    for name, text in [('static', STATIC), ('typical', TYPICAL), ('8k', LONG)]:
+        repeat = max(args.repeat // 10, 5) if text is LONG else args.repeat
+        before = timed(old_format_response, text, repeat)
+        after = timed(render_markdown, text, repeat)
+        print(f"{name:<10} {len(text):>7} {before:>10.3f} {before * 2:>13.3f} {after:>9.3f}")
+
+    print()
+    print(f"{'renders':>8} {'whole ms':>10} {'blocks ms':>10}")
+    for renders in (24, 100, 300):
+        whole = timed(lambda text: stream_whole(text, renders), LONG, 3)
+        blocks = timed(lambda text: stream_blocks(text, renders), LONG, 3)
+        print(f"{renders:>8} {whole:>10.1f} {blocks:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Drive full intake -> chat -> self-pay sessions and report latency per route.
+
+Usage: python benchmarks/load_test.py [--url http://host:port] [--sessions 50]
+       [--concurrency 10] [--questions 3] [--stream]
+       [--fake-latency 0.5] [--fake-tokens-per-second 200] [--fake-error-rate 0]
+
+Without --url the app is started in-process on a free port with the fake
+LLM backend and a throwaway database, so no API quota is used. Each virtual
+patient keeps its own cookie jar and walks the whole flow: greeting, the
+seven intake answers, a few questions, the self-pay form and its submission.
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INTAKE = ['王小明', '62', '男', '膝關節置換', '是', '高血壓', '怕痛']
+QUESTIONS = [
+    '全身麻醉會不會醒不過來？',
+    '手術前要禁食多久？',
+    '我有高血壓，麻醉風險高嗎？',
+    '麻醉深度監測有什麼好處？',
+    '術後會很痛嗎？',
+]
+SELECTED_ITEMS = [{'name': '麻醉深度監測', 'price': 1711}, {'name': '自控式止痛', 'price': 6500}]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, route, seconds, ok):
+        with self._lock:
+            self.samples[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class VirtualPatient:
+    def __init__(self, base_url, recorder, questions, stream):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.questions = questions
+        self.stream = stream
+        self.user_id = uuid.uuid4().hex
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, route, method, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        started = time.perf_counter()
+        ok = True
+        try:
+            with self.opener.open(req, timeout=120) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            e.read()
+            ok = False
+        except OSError:
+            ok = False
+        self.recorder.add(route, time.perf_counter() - started, ok)
+
+    def chat(self, route, message, **extra):
+        self.request(route, 'POST', '/chat', {'message': message, 'user_id': self.user_id, **extra})
+
+    def run(self):
+        self.chat('POST /chat greeting', '')
+        for answer in INTAKE:
+            self.chat('POST /chat intake', answer)
+        for i in range(self.questions):
+            question = QUESTIONS[i % len(QUESTIONS)]
+            if self.stream:
+                self.chat('POST /chat stream', question, stream=True)
+            else:
+                self.chat('POST /chat answer', question)
+        self.request('GET /self_pay', 'GET', f'/self_pay?user_id={self.user_id}')
+        self.request('POST /submit_self_pay', 'POST', '/submit_self_pay',
+                     {'user_id': self.user_id, 'selected_items': SELECTED_ITEMS})
+
+
+def start_local_app(args):
+    """Serve the app in this process with the fake LLM and a temporary database"""
+    tmp = tempfile.mkdtemp()
+    os.environ.update({
+        'LLM_BACKEND': 'fake',
+        'FAKE_LLM_LATENCY': str(args.fake_latency),
+        'FAKE_LLM_TOKENS_PER_SECOND': str(args.fake_tokens_per_second),
+        'FAKE_LLM_ERROR_RATE': str(args.fake_error_rate),
+        'DATABASE_URL': f"sqlite:///{os.path.join(tmp, 'load.db')}",
+        'SESSION_STORE_URI': f"sqlite:///{os.path.join(tmp, 'sessions.db')}",
+        'METRICS_DIR': os.path.join(tmp, 'metrics'),
+        'LOG_LEVEL': 'WARNING',
+    })
+    from werkzeug.serving import make_server
+    from app import create_app
+    app = create_app()
+    # Keep werkzeug's per-request access log out of the report
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='running app to test; default starts one with the fake LLM')
+    parser.add_argument('--sessions', type=int, default=50, help='virtual patients in total')
+    parser.add_argument('--concurrency', type=int, default=10, help='virtual patients at once')
+    parser.add_argument('--questions', type=int, default=3, help='chat questions per patient')
+    parser.add_argument('--stream', action='store_true', help='ask for streamed answers')
+    parser.add_argument('--fake-latency', type=float, default=0.5)
+    parser.add_argument('--fake-tokens-per-second', type=float, default=200)
+    parser.add_argument('--fake-error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/') if args.url else start_local_app(args)
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        patients = [VirtualPatient(base_url, recorder, args.questions, args.stream) for _ in range(args.sessions)]
+        for future in [pool.submit(patient.run) for patient in patients]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.sessions} sessions, concurrency {args.concurrency}, {elapsed:.1f} s")
+    print(f"{'route':<24} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    total = 0
+    for route, samples in recorder.samples.items():
+        samples = sorted(samples)
+        total += len(samples)
+        print(f"{route:<24} {len(samples):>9} {recorder.errors[route]:>7} {len(samples) / elapsed:>8.1f} "
+              f"{percentile(samples, 0.50) * 1000:>9.1f} {percentile(samples, 0.95) * 1000:>9.1f} "
+              f"{percentile(samples, 0.99) * 1000:>9.1f}")
+    print(f"{'all':<24} {total:>9} {sum(recorder.errors.values()):>7} {total / elapsed:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Measure worker cold start: import, create_app(), first request, first render, first LLM use.
+
+Usage: python benchmarks/startup.py [--runs 5]
+
+Each run is a fresh interpreter with a throwaway database, so every phase
+pays its real one-time cost. The LLM phase builds the Gemini client with a
+dummy key, which imports the SDK but makes no network call.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, sys, time
+timings = {}
+started = time.perf_counter()
+import app
+timings['import'] = time.perf_counter() - started
+
+started = time.perf_counter()
+app.create_app()
+timings['create_app'] = time.perf_counter() - started
+
+client = app.app.test_client()
+started = time.perf_counter()
+client.get('/')
+timings['first_request'] = time.perf_counter() - started
+
+started = time.perf_counter()
+app.format_response('## 您好\n\n* 第一次回覆')
+timings['first_render'] = time.perf_counter() - started
+
+started = time.perf_counter()
+app.get_model()
+timings['first_llm_use'] = time.perf_counter() - started
+
+print(json.dumps(timings))
+"""
+
+PHASES = ['import', 'create_app', 'first_request', 'first_render', 'first_llm_use']
+
+
+def run_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'startup.db')}",
+            SESSION_STORE_URI=f"sqlite:///{os.path.join(tmp, 'sessions.db')}",
+            METRICS_DIR=os.path.join(tmp, 'metrics'),
+            GOOGLE_API_KEY='startup-benchmark',
+            LLM_BACKEND='gemini',
+            LOG_LEVEL='WARNING',
+        )
+        output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                                check=True, capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    # One throwaway run so bytecode compilation is not counted
+    run_once()
+    runs = [run_once() for _ in range(args.runs)]
+
+    print(f"{'phase':<15} {'median ms':>10} {'max ms':>8}")
+    for phase in PHASES:
+        samples = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<15} {statistics.median(samples):>10.1f} {max(samples):>8.1f}")
+    ready = [(run['import'] + run['create_app'] + run['first_request']) * 1000 for run in runs]
+    print(f"{'ready to serve':<15} {statistics.median(ready):>10.1f} {max(ready):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Earlier chat turns for the prompt, kept within a token budget.
+
+The most recent turns are sent verbatim. When they no longer fit, the
+oldest are folded into a running summary of one line per turn. Each line
+is computed once, when its turn leaves the verbatim window, and is stored
+with the conversation, so building the context costs about the same on
+the 50th question as on the 2nd.
+"""
+import re
+
+# Gemini uses roughly one token per CJK character and one per four other characters
+CJK_PATTERN = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+# Markdown markers stripped from the start of a summarized line
+MARKUP_PATTERN = re.compile(r'^(?:[#>*+\-]|\d+\.)+\s*')
+
+# Characters of a turn kept in its summary line
+SUMMARY_LINE_CHARS = 60
+
+LABELS = {"user": "病人", "bot": "顧問"}
+
+
+def estimate_tokens(text):
+    """Approximate Gemini token count of text without calling the API"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def summarize_turn(turn):
+    """One line standing in for a turn: its leading lines of text, clipped"""
+    parts = []
+    length = 0
+    for line in (turn.get("message") or "").splitlines():
+        text = MARKUP_PATTERN.sub('', line.strip()).replace('**', '').strip()
+        if not text:
+            continue
+        parts.append(text)
+        length += len(text)
+        if length >= SUMMARY_LINE_CHARS:
+            break
+    text = "；".join(parts)
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS] + "…"
+    return f"{LABELS.get(turn.get('role'), turn.get('role'))}：{text}"
+
+
+def _turn_line(turn):
+    return f"{LABELS.get(turn.get('role'), turn.get('role'))}：{turn.get('message') or ''}"
+
+
+def fold_history(turns, summary, history_tokens, summary_tokens):
+    """Split turns into the ones sent verbatim and the ones folded into summary.
+
+    turns are the transcript entries not summarized yet, oldest first. The
+    newest turns that fit in history_tokens minus summary_tokens stay
+    verbatim; the older ones get a line each appended to summary (a list,
+    changed in place), whose oldest lines are dropped beyond summary_tokens.
+    Returns (recent turns, number of leading turns folded).
+    """
+    budget = history_tokens - summary_tokens
+    keep = 0
+    for turn in reversed(turns):
+        cost = estimate_tokens(_turn_line(turn))
+        if cost > budget:
+            break
+        budget -= cost
+        keep += 1
+    folded = len(turns) - keep
+
+    if folded:
+        summary.extend(summarize_turn(turn) for turn in turns[:folded])
+        total = sum(estimate_tokens(line) for line in summary)
+        while summary and total > summary_tokens:
+            total -= estimate_tokens(summary.pop(0))
+    return turns[folded:], folded
+
+
+def format_history(summary, recent):
+    """Prompt section with the summary of older turns and the recent turns verbatim"""
+    sections = []
+    if summary:
+        sections.append("### 先前對話摘要:\n" + "\n".join(f"- {line}" for line in summary))
+    if recent:
+        sections.append("### 最近對話:\n" + "\n".join(_turn_line(turn) for turn in recent))
+    return "\n\n".join(sections)
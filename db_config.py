@@ -0,0 +1,79 @@
+"""Database URL, logging and connection tuning, chosen from the environment.
+
+DATABASE_URL picks the backend; it defaults to patients.db next to the app.
+On SQLite every new connection is switched to WAL journaling with
+synchronous=NORMAL, a busy timeout and memory-mapped reads, so readers no
+longer block behind each commit from another worker. All backends get a
+sized connection pool, which a forked worker replaces with its own.
+"""
+import logging
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def configure_database(app):
+    """Fill in the SQLALCHEMY_* settings for app; call before db.init_app"""
+    default_url = f"sqlite:///{os.path.join(app.root_path, 'patients.db')}"
+    url = os.getenv('DATABASE_URL', default_url)
+    # Heroku-style URLs use the postgres:// scheme SQLAlchemy no longer accepts
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ECHO'] = os.getenv('SQLALCHEMY_ECHO', '0') == '1'  # Log every SQL statement
+    app.config['SQLITE_BUSY_TIMEOUT'] = _env_int('SQLITE_BUSY_TIMEOUT', 5000)  # Milliseconds a writer waits for the lock
+    app.config['SQLITE_MMAP_SIZE'] = _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)  # Bytes of the file read via mmap
+
+    sa_url = make_url(url)
+    options = {
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),  # Seconds before a connection is replaced
+    }
+    if sa_url.get_backend_name() == 'sqlite' and sa_url.database in (None, '', ':memory:'):
+        # Flask-SQLAlchemy keeps an in-memory database on a single static connection
+        options = {}
+    elif sa_url.get_backend_name() == 'sqlite':
+        # SQLAlchemy 1.4 opens a new file connection per checkout; pool them so
+        # PRAGMAs and the mmap are set up once per connection, not per request
+        options['poolclass'] = QueuePool
+        options['connect_args'] = {
+            'check_same_thread': False,  # The pool hands a connection to one thread at a time
+            'timeout': app.config['SQLITE_BUSY_TIMEOUT'] / 1000,  # pysqlite's busy handler, in seconds
+        }
+    else:
+        options['pool_pre_ping'] = True
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    logging.getLogger('sqlalchemy.engine').setLevel(os.getenv('SQLALCHEMY_LOG_LEVEL', 'WARNING'))
+
+
+def tune_engine(engine, config):
+    """Apply the SQLite PRAGMAs to every new connection of engine, and give forked children a fresh pool"""
+    # A connection opened before a fork (e.g. gunicorn --preload) must not be used
+    # by the child; drop the inherited pool there without closing the parent's connections
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': config.get('SQLITE_BUSY_TIMEOUT', 5000),
+        'mmap_size': config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+    }
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
@@ -0,0 +1,153 @@
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+
+from models import db, Patient, SelfPayItem, ChatHistory
+
+# Exportable tables and the timestamp column the date range applies to
+TABLES = {
+    'patients': (Patient, 'created_at'),
+    'self_pay_items': (SelfPayItem, 'selected_at'),
+    'chats': (ChatHistory, 'created_at'),
+}
+
+def parse_date_range(date_from=None, date_to=None):
+    """Turn YYYY-MM-DD bounds into a half-open datetime range; date_to is inclusive"""
+    start = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+    end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+    return start, end
+
+
+def export_rows(table, start=None, end=None, batch_size=1000):
+    """Yield lists of row dicts from one table, batch_size rows at a time.
+
+    Rows are read through a streaming Core cursor rather than ORM objects, so
+    nothing accumulates in the session and memory stays flat however many
+    rows match.
+    """
+    model, time_column = TABLES[table]
+    columns = model.__table__.c
+    query = db.select(model.__table__).order_by(columns[time_column], columns.id)
+    if start:
+        query = query.where(columns[time_column] >= start)
+    if end:
+        query = query.where(columns[time_column] < end)
+
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(query)
+        for partition in result.mappings().partitions(batch_size):
+            yield [dict(row) for row in partition]
+
+
+def column_names(table):
+    return [column.name for column in TABLES[table][0].__table__.columns]
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(table, batches):
+    """Encode row batches as CSV text, header first"""
+    names = column_names(table)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=names)
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows({name: _plain(row[name]) for name in names} for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(table, batches):
+    """Encode row batches as one JSON object per line"""
+    names = column_names(table)
+    for batch in batches:
+        yield ''.join(
+            json.dumps({name: _plain(row[name]) for name in names}, ensure_ascii=False) + '\n'
+            for row in batch
+        )
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_schema(pa, table):
+    fields = []
+    for column in TABLES[table][0].__table__.columns:
+        sql_type = column.type
+        if isinstance(sql_type, db.Integer):
+            arrow_type = pa.int64()
+        elif isinstance(sql_type, db.Float):
+            arrow_type = pa.float64()
+        elif isinstance(sql_type, db.DateTime):
+            arrow_type = pa.timestamp('us')
+        elif isinstance(sql_type, db.Date):
+            arrow_type = pa.date32()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def parquet_chunks(table, batches):
+    """Encode row batches as a Parquet file, one row group per batch"""
+    # Imported here so a missing pyarrow fails before any bytes are sent
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("The pyarrow package is required for Parquet exports")
+
+    schema = _arrow_schema(pa, table)
+
+    def chunks():
+        sink = _ChunkSink()
+        with pq.ParquetWriter(sink, schema) as writer:
+            for batch in batches:
+                columns = {name: [row[name] for row in batch] for name in schema.names}
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                yield sink.drain()
+        yield sink.drain()
+
+    return chunks()
+
+
+# Export format -> (mimetype, encoder)
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', csv_chunks),
+    'ndjson': ('application/x-ndjson', ndjson_chunks),
+    'parquet': ('application/vnd.apache.parquet', parquet_chunks),
+}
+
+
+def export(table, fmt, start=None, end=None, batch_size=1000):
+    """Stream a table as chunks of CSV/NDJSON text or Parquet bytes"""
+    if table not in TABLES:
+        raise ValueError(f"Unknown table {table!r}, expected one of {', '.join(TABLES)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    encoder = FORMATS[fmt][1]
+    return encoder(table, export_rows(table, start, end, batch_size))
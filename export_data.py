@@ -0,0 +1,24 @@
+import argparse
+from app import app
+from export import TABLES, FORMATS, export, parse_date_range
+
+def export_data(table, fmt, output, date_from=None, date_to=None):
+    with app.app_context():
+        start, end = parse_date_range(date_from, date_to)
+        chunks = export(table, fmt, start, end)
+        # Write to a file; the export can be large and binary (Parquet)
+        with open(output, 'wb') as out:
+            for chunk in chunks:
+                out.write(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+        print(f"Exported {table} to {output}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export patients, self-pay items or chats')
+    parser.add_argument('table', choices=list(TABLES))
+    parser.add_argument('--format', default='csv', choices=list(FORMATS))
+    parser.add_argument('--from', dest='date_from', help='first day to include, YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', help='last day to include, YYYY-MM-DD')
+    parser.add_argument('--output', '-o', help='file to write, defaults to <table>.<format>')
+    args = parser.parse_args()
+    output = args.output or f"{args.table}.{args.format}"
+    export_data(args.table, args.format, output, args.date_from, args.date_to)
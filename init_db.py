@@ -1,15 +1,19 @@
+import sys
 from app import app, db, User
+from migrations import migrate
 from werkzeug.security import generate_password_hash
 
-def init_db():
+def init_db(reset=False):
     with app.app_context():
-        # Drop all tables first to ensure clean state
-        db.drop_all()
-        print("Dropped all existing tables")
+        if reset:
+            # Drop all tables first to ensure clean state
+            db.drop_all()
+            print("Dropped all existing tables")
         
-        # Create all tables
+        # Create missing tables and upgrade existing ones in place
         db.create_all()
         print("Created all tables")
+        print(f"Schema is at version {migrate()}")
         
         # Check if admin user exists
         admin = User.query.filter_by(username='admin').first()
@@ -26,4 +30,5 @@ def init_db():
             print("Admin user already exists!")
 
 if __name__ == '__main__':
-    init_db()
+    # Pass --reset to wipe all data and start from an empty database
+    init_db(reset='--reset' in sys.argv)
@@ -0,0 +1,142 @@
+"""LLM backends behind the generate_content interface the app calls.
+
+create_model() returns either the real Gemini model or FakeModel, a local
+stand-in with configurable latency, streaming speed and error injection for
+load tests that must not spend API quota. Both accept
+generate_content(contents, stream=False) and return a response with .text
+and .usage_metadata, or an iterator of such chunks when streaming.
+"""
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+GENERATION_CONFIG = {
+    "temperature": 1,              # Maximum creativity
+    "top_p": 0.95,                # High diversity in responses
+    "top_k": 40,                  # Top-k sampling parameter
+    "max_output_tokens": 8192,     # Increased maximum response length
+}
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+]
+
+
+class FakeLLMError(Exception):
+    """Failure injected by FakeModel"""
+
+    # Behaves like an upstream 503, so the retry and circuit breaker logic treat it as transient
+    code = 503
+
+
+# Canned answer the fake backend repeats up to the configured length
+FAKE_ANSWER = """## 麻醉說明 😊
+
+* 手術前 **6 小時** 禁食固體食物，**2 小時** 禁喝清水
+* 麻醉團隊會全程監測您的生命徵象
+* 若有任何不舒服，請隨時告訴醫護人員
+
+"""
+
+
+class FakeModel:
+    """Local stand-in for the Gemini model.
+
+    Waits ``latency`` seconds (with up to ``jitter`` of that added at random)
+    before the first token, then produces ``response_tokens`` characters at
+    ``tokens_per_second``. With probability ``error_rate`` a call fails with
+    FakeLLMError instead; streams fail after the first chunk so partial
+    answers are exercised too.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.2, tokens_per_second=200, response_tokens=400,
+                 chunk_tokens=20, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.chunk_tokens = chunk_tokens
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random(), self._random.random()
+
+    def _text(self):
+        repeats = self.response_tokens // len(FAKE_ANSWER) + 1
+        return (FAKE_ANSWER * repeats)[:self.response_tokens]
+
+    def _usage(self, contents, output_tokens):
+        return SimpleNamespace(prompt_token_count=len(str(contents)), candidates_token_count=output_tokens)
+
+    def generate_content(self, contents, stream=False):
+        jitter, failure = self._roll()
+        time.sleep(self.latency * (1 + self.jitter * jitter))
+        fail = failure < self.error_rate
+        if stream:
+            return self._stream(contents, fail)
+        if fail:
+            raise FakeLLMError("Injected LLM failure")
+        text = self._text()
+        time.sleep(len(text) / self.tokens_per_second)
+        return SimpleNamespace(text=text, usage_metadata=self._usage(contents, len(text)))
+
+    def _stream(self, contents, fail):
+        text = self._text()
+        for start in range(0, len(text), self.chunk_tokens):
+            if fail and start:
+                raise FakeLLMError("Injected LLM failure mid-stream")
+            piece = text[start:start + self.chunk_tokens]
+            time.sleep(len(piece) / self.tokens_per_second)
+            last = start + self.chunk_tokens >= len(text)
+            yield SimpleNamespace(text=piece, usage_metadata=self._usage(contents, len(text)) if last else None)
+
+
+def create_gemini_model(system_instruction):
+    """Configure the Gemini SDK from GOOGLE_API_KEY and return the model"""
+    api_key = os.getenv('GOOGLE_API_KEY')
+    if not api_key:
+        raise ValueError("No API key found. Please set GOOGLE_API_KEY in your .env file")
+
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(
+        model_name="gemini-2.0-flash-exp",
+        generation_config=GENERATION_CONFIG,
+        safety_settings=SAFETY_SETTINGS,
+        system_instruction=system_instruction
+    )
+
+
+def create_model(config, system_instruction):
+    """Build the model selected by config['LLM_BACKEND']: gemini or fake"""
+    backend = config.get('LLM_BACKEND', 'gemini')
+    if backend == 'gemini':
+        return create_gemini_model(system_instruction)
+    if backend == 'fake':
+        return FakeModel(
+            latency=config.get('FAKE_LLM_LATENCY', 0.5),
+            tokens_per_second=config.get('FAKE_LLM_TOKENS_PER_SECOND', 200),
+            response_tokens=config.get('FAKE_LLM_RESPONSE_TOKENS', 400),
+            error_rate=config.get('FAKE_LLM_ERROR_RATE', 0.0),
+        )
+    raise ValueError(f"Unknown LLM backend {backend!r}, expected gemini or fake")
@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+class LLMBusyError(Exception):
+    """Raised when the LLM pool and its wait queue are full"""
+
+
+class LLMTimeoutError(Exception):
+    """Raised when an LLM call does not finish within its timeout"""
+
+
+_DONE = object()
+
+
+class LLMExecutor:
+    """Bounded thread pool for LLM calls.
+
+    At most ``max_concurrency`` calls run at once and at most ``max_queue``
+    more may wait for a free worker. Anything beyond that is rejected
+    immediately with LLMBusyError so the web worker can answer "busy, retry"
+    instead of waiting without bound.
+    """
+
+    def __init__(self, max_concurrency=4, max_queue=8, timeout=60):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='llm')
+        self._slots = threading.BoundedSemaphore(max_concurrency + max_queue)
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule fn on the pool, or raise LLMBusyError if no slot is free"""
+        if not self._slots.acquire(blocking=False):
+            raise LLMBusyError("LLM queue is full")
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def call(self, fn, *args, timeout=None, **kwargs):
+        """Run fn on the pool and wait for its result up to the timeout"""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except FutureTimeoutError:
+            # Drop it if it has not started yet; a running call is left to finish
+            future.cancel()
+            raise LLMTimeoutError("LLM call timed out")
+
+    def stream(self, fn, *args, timeout=None, **kwargs):
+        """Iterate the result of fn on the pool and return a generator of its items.
+
+        The slot is taken right away, so LLMBusyError is raised here rather
+        than on first iteration. The whole stream must finish within the timeout.
+        When the consumer stops early (timeout, error or a closed generator),
+        the producer stops reading at the next item and frees its slot.
+        """
+        items = queue.Queue()
+        cancelled = threading.Event()
+        deadline = time.monotonic() + (timeout or self.timeout)
+
+        def produce():
+            source = None
+            try:
+                source = iter(fn(*args, **kwargs))
+                for item in source:
+                    # Nobody reads past the deadline, even if consume() never started
+                    if cancelled.is_set() or time.monotonic() > deadline:
+                        return
+                    items.put((item, None))
+            except Exception as e:
+                items.put((None, e))
+                return
+            finally:
+                close = getattr(source, 'close', None)
+                if close is not None:
+                    close()
+            items.put((_DONE, None))
+
+        self.submit(produce)
+
+        def consume():
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMTimeoutError("LLM stream timed out")
+                    try:
+                        item, error = items.get(timeout=remaining)
+                    except queue.Empty:
+                        raise LLMTimeoutError("LLM stream timed out")
+                    if error is not None:
+                        raise error
+                    if item is _DONE:
+                        return
+                    yield item
+            finally:
+                cancelled.set()
+
+        return consume()
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
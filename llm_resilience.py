@@ -0,0 +1,221 @@
+"""Retries, rate limiting and a circuit breaker around LLM calls.
+
+ResilientLLM wraps a generate_content callable:
+
+- each attempt first takes a token from a TokenBucket sized to the API
+  quota, so bursts queue briefly instead of earning 429s;
+- transient upstream errors (429, 5xx, timeouts, dropped connections) are
+  retried with full-jitter exponential backoff within a time budget;
+- a CircuitBreaker stops calling an upstream that keeps failing. While it
+  is open calls fail at once with CircuitOpenError, so the app can answer
+  from static content with bounded latency.
+"""
+import logging
+import random
+import threading
+import time
+
+import metrics
+from llm_executor import LLMBusyError
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying; google.api_core errors carry theirs in .code
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+_END = object()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the LLM while the circuit breaker is open"""
+
+
+class RateLimitedError(LLMBusyError):
+    """Raised when the request budget stays exhausted for longer than the allowed wait"""
+
+
+def is_transient(error):
+    """Whether error is an upstream hiccup that a later attempt may not hit"""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code in TRANSIENT_STATUS
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class TokenBucket:
+    """Allows ``rate`` calls per second on average and bursts of up to ``capacity``"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait=0):
+        """Take a token, sleeping until it is due; return the seconds waited.
+
+        Raises RateLimitedError without taking anything if the token would
+        not be due within max_wait seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                raise RateLimitedError("LLM request rate limit reached")
+            # Reserve the token now so waiters are served in arrival order
+            self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures.
+
+    While open every call is refused for ``reset_timeout`` seconds. After
+    that a single trial call is let through (half-open): success closes the
+    circuit, failure opens it for another ``reset_timeout``.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Whether a call may go ahead now; in half-open state only the first caller may"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("llm circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("llm circuit opened failures=%d reset_seconds=%s",
+                                   self._failures, self.reset_timeout)
+                    metrics.inc('llm_circuit_opened_total')
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ResilientLLM:
+    """generate_content with rate limiting, retries and a circuit breaker.
+
+    ``generate`` is the underlying generate_content callable. At most
+    ``retries`` extra attempts are made, the n-th after a random delay of
+    up to ``min(max_delay, base_delay * 2**n)`` seconds, and never past
+    ``budget`` seconds after the first attempt began. ``bucket`` may be None
+    to skip rate limiting; ``max_wait`` bounds the wait for a token.
+    """
+
+    def __init__(self, generate, breaker, bucket=None, retries=2, base_delay=0.5, max_delay=8.0,
+                 budget=60.0, max_wait=2.0):
+        self.generate = generate
+        self.breaker = breaker
+        self.bucket = bucket
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.max_wait = max_wait
+
+    def available(self):
+        """Whether a call could be attempted now, i.e. the circuit is not open"""
+        return self.breaker.state != CircuitBreaker.OPEN
+
+    def generate_content(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream(args, kwargs)
+        return self._call(lambda: self.generate(*args, **kwargs))
+
+    def _call(self, fn):
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            if not self.available():
+                raise CircuitOpenError("LLM circuit is open")
+            if self.bucket is not None:
+                self.bucket.acquire(self.max_wait)
+            if not self.breaker.allow():
+                raise CircuitOpenError("LLM circuit is open")
+            try:
+                result = fn()
+            except Exception as e:
+                self._record(e)
+                delay = self._retry_delay(e, attempt, started)
+                if delay is None:
+                    raise
+                attempt += 1
+                metrics.inc('llm_retries_total')
+                logger.info("llm retry attempt=%d delay_ms=%.0f error=%r", attempt, delay * 1000, e)
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _record(self, error):
+        if is_transient(error):
+            self.breaker.record_failure()
+        else:
+            # The upstream answered, it just rejected this request
+            self.breaker.record_success()
+
+    def _retry_delay(self, error, attempt, started):
+        """Seconds to wait before the next attempt, or None to give up"""
+        if attempt >= self.retries or not is_transient(error) or not self.available():
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if time.monotonic() - started + delay > self.budget:
+            return None
+        return delay
+
+    def _start_stream(self, args, kwargs):
+        chunks = iter(self.generate(*args, stream=True, **kwargs))
+        return chunks, next(chunks, _END)
+
+    def _stream(self, args, kwargs):
+        """Retry until the first chunk arrives; after that a failure ends the stream"""
+        chunks, first = self._call(lambda: self._start_stream(args, kwargs))
+        if first is _END:
+            return
+        yield first
+        try:
+            yield from chunks
+        except Exception as e:
+            self._record(e)
+            raise
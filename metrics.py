@@ -0,0 +1,276 @@
+"""In-process counters and histograms rendered as Prometheus text.
+
+Metrics are created on first use and keyed by name and label values, so
+call sites only name what they measure:
+
+    metrics.inc('llm_errors_total', kind='generate')
+    with metrics.timer('db_commit_seconds'):
+        ...
+
+Gauges are callbacks read when metrics are published:
+
+    metrics.gauge('write_queue_depth', lambda: write_queue.stats()['depth'])
+
+Each process keeps its own numbers. Under a multi-process server every
+scrape lands on a random worker, so call configure() with a directory
+shared by the workers: each process then writes a snapshot of its metrics
+there every ``interval`` seconds, and render() adds up the snapshots of
+all processes. Counters and histograms of exited workers keep counting;
+their gauges are dropped. Empty the directory when the server is
+redeployed, as with prometheus_client's multiprocess mode.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from a fast SQLite read up to a slow Gemini answer
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+    'http_requests_total': 'HTTP requests by route, method and status',
+    'http_request_seconds': 'Time to build an HTTP response by route',
+    'chat_turns_total': 'Chat turns handled by intake step',
+    'chat_turn_seconds': 'Time to answer a chat turn by intake step',
+    'llm_request_seconds': 'Gemini call latency by kind',
+    'llm_tokens_total': 'Gemini tokens by kind and direction',
+    'llm_errors_total': 'Failed Gemini calls by kind',
+    'llm_busy_total': 'Chat turns rejected because the LLM pool was full or over the rate limit',
+    'llm_retries_total': 'Gemini calls retried after a transient error',
+    'llm_circuit_opened_total': 'Times the LLM circuit breaker opened',
+    'llm_fallback_total': 'Answers served from static content instead of Gemini by reason',
+    'db_commit_seconds': 'Database commit latency',
+    'format_response_seconds': 'Markdown rendering and sanitizing time',
+    'template_render_seconds': 'Jinja template render time by template',
+    'session_seconds': 'Server-side session load and save time by operation',
+    'analytics_query_seconds': 'Time to compute analytics day aggregates by kind (fill or refresh)',
+    'answer_cache_requests_total': 'Answer cache lookups by result (hit or miss)',
+    'write_queue_depth': 'Write-behind jobs waiting to be written',
+    'write_queue_lag_seconds': 'Age of the oldest waiting write-behind job',
+}
+
+# How gauges of several processes are combined
+GAUGE_AGGREGATES = {'sum': sum, 'max': max}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_gauges = {}
+
+_directory = None
+_interval = 1.0
+_flusher_pid = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """Add amount to a counter"""
+    key = _key(name, labels)
+    _ensure_flusher()
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """Record one sample in a histogram"""
+    key = _key(name, labels)
+    _ensure_flusher()
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(DEFAULT_BUCKETS), 0, 0.0]
+        buckets = histogram[0]
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                buckets[i] += 1
+                break
+        histogram[1] += 1
+        histogram[2] += value
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the wall time of the with block in seconds, even if it raises"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def gauge(name, fn, aggregate='sum', **labels):
+    """Publish fn() as a gauge; aggregate ('sum' or 'max') combines the values of several processes"""
+    with _lock:
+        _gauges[_key(name, labels)] = (fn, aggregate)
+    _ensure_flusher()
+
+
+def reset():
+    """Forget every recorded value"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def configure(directory, interval=1.0):
+    """Share metrics between the processes that write snapshots to directory"""
+    global _directory, _interval
+    _directory = directory
+    _interval = interval
+
+
+def _after_fork():
+    # The child starts from zero, or the parent's counts would be published twice,
+    # and gets its own lock and flusher thread
+    global _lock, _flusher_pid
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+    _flusher_pid = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _ensure_flusher():
+    """Start this process's snapshot thread once a directory is configured"""
+    global _flusher_pid
+    if _directory is None or _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+    atexit.register(_flush)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(_interval)
+        _flush()
+
+
+def _read_gauges():
+    with _lock:
+        gauges = list(_gauges.items())
+    values = []
+    for (name, labels), (fn, aggregate) in gauges:
+        try:
+            values.append((name, labels, float(fn()), aggregate))
+        except Exception:
+            continue
+    return values
+
+
+def _snapshot():
+    with _lock:
+        counters = [(name, labels, value) for (name, labels), value in _counters.items()]
+        histograms = [(name, labels, list(h[0]), h[1], h[2]) for (name, labels), h in _histograms.items()]
+    return {'counters': counters, 'histograms': histograms, 'gauges': _read_gauges()}
+
+
+def _flush():
+    """Write this process's snapshot to the shared directory"""
+    if _directory is None:
+        return
+    os.makedirs(_directory, exist_ok=True)
+    path = os.path.join(_directory, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(_snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _collect():
+    """Counters, histograms and gauges of every process, merged by name and labels"""
+    if _directory is None:
+        snapshots = [_snapshot()]
+    else:
+        _flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(_directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not _alive(int(os.path.basename(path)[:-len('.json')])):
+                snapshot['gauges'] = []
+            snapshots.append(snapshot)
+
+    counters, histograms, gauges = {}, {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = name, tuple(map(tuple, labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, count, total in snapshot['histograms']:
+            key = name, tuple(map(tuple, labels))
+            merged = histograms.setdefault(key, [[0] * len(DEFAULT_BUCKETS), 0, 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += count
+            merged[2] += total
+        for name, labels, value, aggregate in snapshot['gauges']:
+            gauges.setdefault((name, tuple(map(tuple, labels)), aggregate), []).append(value)
+    gauges = {(name, labels): GAUGE_AGGREGATES[aggregate](values)
+              for (name, labels, aggregate), values in gauges.items()}
+    return sorted(counters.items()), sorted(histograms.items()), sorted(gauges.items())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _header(lines, name, kind, seen):
+    if name in seen:
+        return
+    seen.add(name)
+    if name in HELP:
+        lines.append(f'# HELP {name} {HELP[name]}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format"""
+    counters, histograms, gauges = _collect()
+
+    lines, seen = [], set()
+    for (name, labels), value in counters:
+        _header(lines, name, 'counter', seen)
+        lines.append(f'{name}{_labels(labels)} {value}')
+    for (name, labels), (buckets, count, total) in histograms:
+        _header(lines, name, 'histogram', seen)
+        cumulative = 0
+        for bound, bucket in zip(DEFAULT_BUCKETS, buckets):
+            cumulative += bucket
+            lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {count}')
+        lines.append(f'{name}_sum{_labels(labels)} {total}')
+        lines.append(f'{name}_count{_labels(labels)} {count}')
+    for (name, labels), value in gauges:
+        _header(lines, name, 'gauge', seen)
+        lines.append(f'{name}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,84 @@
+"""Versioned, in-place schema migrations.
+
+Each migration is a (version, description, function) entry in MIGRATIONS.
+migrate() runs the ones newer than the latest row in schema_version, in
+order, and records each as it completes. Migrations must be additive and
+safe to re-run, since a fresh database created by db.create_all() already
+has the current schema.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Patient, SelfPayItem, ChatHistory, SchemaVersion, PatientDailyCount
+
+logger = logging.getLogger(__name__)
+
+
+def _create_index(table, name):
+    """Create a declared index if it does not exist yet"""
+    index = next(index for index in table.indexes if index.name == name)
+    index.create(bind=db.engine, checkfirst=True)
+
+
+def add_query_indexes():
+    _create_index(Patient.__table__, 'ix_patient_created_at')
+    _create_index(Patient.__table__, 'ix_patient_name')
+    _create_index(SelfPayItem.__table__, 'ix_self_pay_item_patient_id')
+    _create_index(ChatHistory.__table__, 'ix_chat_history_patient_id_created_at')
+
+
+def add_patient_daily_counts():
+    PatientDailyCount.__table__.create(bind=db.engine, checkfirst=True)
+    # Backfill the rollup from existing patients
+    day = db.func.date(Patient.created_at)
+    rows = db.session.query(day, db.func.count(Patient.id)).group_by(day).all()
+    db.session.query(PatientDailyCount).delete()
+    for value, count in rows:
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = datetime.strptime(value, '%Y-%m-%d').date()
+        db.session.add(PatientDailyCount(day=value, count=count))
+
+
+def add_selected_at_index():
+    _create_index(SelfPayItem.__table__, 'ix_self_pay_item_selected_at')
+
+
+MIGRATIONS = [
+    (1, "Add indexes for dashboard and patient detail queries", add_query_indexes),
+    (2, "Add per-day patient counts for the dashboard", add_patient_daily_counts),
+    (3, "Index self-pay selections by time for analytics refreshes", add_selected_at_index),
+]
+
+
+def current_version():
+    """Return the latest applied migration version, 0 for a baseline schema"""
+    SchemaVersion.__table__.create(bind=db.engine, checkfirst=True)
+    return db.session.query(db.func.max(SchemaVersion.version)).scalar() or 0
+
+
+def migrate():
+    """Apply pending migrations; must run inside an application context"""
+    version = current_version()
+    for target, description, upgrade in MIGRATIONS:
+        if target <= version:
+            continue
+        logger.info("applying migration version=%d description=%s", target, description)
+        upgrade()
+        db.session.add(SchemaVersion(version=target, description=description, applied_at=datetime.utcnow()))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker recorded the same migration first
+            db.session.rollback()
+        version = target
+    return version
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        print(f"Schema is at version {migrate()}")
@@ -17,21 +17,21 @@ class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sex = db.Column(db.String(10))
     age = db.Column(db.Integer)
-    name = db.Column(db.String(100))
+    name = db.Column(db.String(100), index=True)
     operation = db.Column(db.String(200))
     cfs = db.Column(db.String(50))
     medical_history = db.Column(db.Text)
     worry = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     self_pay_items = db.relationship('SelfPayItem', backref='patient', lazy=True)
     chat_history = db.relationship('ChatHistory', backref='patient', lazy=True)
 
 class SelfPayItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'))
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), index=True)
     item_name = db.Column(db.String(100))
     price = db.Column(db.Float)
-    selected_at = db.Column(db.DateTime, default=datetime.utcnow)
+    selected_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
 class ChatHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -40,6 +40,30 @@ class ChatHistory(db.Model):
     response = db.Column(db.Text)  # API response
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     message_type = db.Column(db.String(10))  # 'user' or 'bot'
+    
+    __table_args__ = (
+        db.Index('ix_chat_history_patient_id_created_at', 'patient_id', 'created_at'),
+    )
+
+class PatientDailyCount(db.Model):
+    # Patients created per UTC day, maintained on insert for the dashboard
+    day = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+def increment_daily_count(day):
+    """Add one patient to the rollup row for day, creating it if needed"""
+    table = PatientDailyCount.__table__
+    updated = db.session.execute(
+        table.update().where(table.c.day == day).values(count=table.c.count + 1)
+    ).rowcount
+    if not updated:
+        db.session.execute(table.insert().values(day=day, count=1))
+
+class SchemaVersion(db.Model):
+    # Applied migrations, see migrations.py
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200))
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 def init_login_manager(app):
     login_manager.init_app(app)
@@ -0,0 +1,170 @@
+"""Deterministic self-pay recommendations from intake answers.
+
+These are the rules SYSTEM_PROMPT describes to the model, evaluated locally
+so /self_pay and the intake summary get the same answer every time without
+an LLM call. Keyword patterns are compiled once at import, so scoring a
+patient costs a handful of regex searches.
+"""
+import re
+from collections import Counter
+
+# Item key -> (name shown on the self-pay form, price in NT$)
+ITEMS = {
+    'depth_monitor': ('麻醉深度監測', 1711),
+    'muscle_monitor': ('最適肌張力手術輔助處置', 6500),
+    'pca': ('自控式止痛', 6500),
+    'warming': ('溫毯', 980),
+    'anti_nausea': ('止吐藥', 99),
+}
+
+# Conditions that make a patient ASA 3 (severe systemic disease) or ASA 2 (mild)
+ASA3_PATTERN = re.compile(
+    r'心臟|心衰|心肌|冠心|心律不整|支架|中風|腦梗|慢性阻塞|COPD|肺氣腫|洗腎|透析|腎衰|尿毒|肝硬化|癌|腫瘤',
+    re.IGNORECASE
+)
+ASA2_PATTERN = re.compile(
+    r'高血壓|血壓|糖尿病|血糖|氣喘|哮喘|甲狀腺|肥胖|抽菸|吸菸|抽煙|吸煙|高血脂|痛風|貧血|B肝|C肝|肝炎',
+    re.IGNORECASE
+)
+NO_HISTORY_PATTERN = re.compile(r'^\s*(無|沒有|否|none|no)?\s*(特殊)?(病史)?\s*$', re.IGNORECASE)
+
+# Rough expected length in hours of common operations, checked longest first
+OPERATION_HOURS = [
+    (re.compile(r'開心|心臟|冠狀動脈繞道|瓣膜'), 4),
+    (re.compile(r'脊椎|脊柱|椎間盤'), 3),
+    (re.compile(r'關節置換|置換|肝臟|胰臟|胃切除|大腸|直腸|食道'), 2.5),
+    (re.compile(r'膽囊|甲狀腺|乳房|子宮|卵巢|攝護腺|前列腺|腎'), 1.5),
+    (re.compile(r'剖腹產|疝氣|痔瘡|闌尾|盲腸|扁桃腺'), 1),
+    (re.compile(r'白內障|內視鏡|胃鏡|大腸鏡|拔牙|人工流產'), 0.5),
+]
+
+WORRY_PATTERNS = {
+    'pain': re.compile(r'痛'),
+    'nausea': re.compile(r'暈|吐|噁心'),
+    'cold': re.compile(r'冷'),
+    'anxiety': re.compile(r'失眠|睡不著|緊張|焦慮|害怕|怕醒|知覺'),
+}
+
+WORRY_LABELS = {
+    'pain': '疼痛',
+    'nausea': '暈車或噁心',
+    'cold': '怕冷',
+    'anxiety': '失眠或緊張',
+}
+
+
+def _age(info):
+    try:
+        return int(info.get('age'))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_asa(info):
+    """Estimate the ASA class (1-3) from medical_history and age"""
+    history = info.get('medical_history') or ''
+    if ASA3_PATTERN.search(history):
+        return 3
+    age = _age(info)
+    if ASA2_PATTERN.search(history) or (age is not None and age > 65):
+        return 2
+    if NO_HISTORY_PATTERN.match(history):
+        return 1
+    # Some other condition was named; assume it is at least mild
+    return 2
+
+
+def worry_topics(info):
+    """Keys of WORRY_PATTERNS that the worry answer mentions, in WORRY_PATTERNS order"""
+    worry = info.get('worry') or ''
+    return [topic for topic, pattern in WORRY_PATTERNS.items() if pattern.search(worry)]
+
+
+def estimate_operation_hours(info):
+    """Expected length of the operation in hours, or None if it is not recognized"""
+    operation = info.get('operation') or ''
+    for pattern, hours in OPERATION_HOURS:
+        if pattern.search(operation):
+            return hours
+    return None
+
+
+def recommend(info):
+    """Return {item key: [reasons]} for the items the rules suggest, in ITEMS order.
+
+    info is a patient_info dict or an export row with the same keys.
+    """
+    age = _age(info)
+    asa = estimate_asa(info)
+    hours = estimate_operation_hours(info)
+    worry = info.get('worry') or ''
+    frail = info.get('cfs') == '否'
+
+    reasons = {}
+
+    def add(reason, *items):
+        for item in items:
+            reasons.setdefault(item, []).append(reason)
+
+    if age is not None and age > 50:
+        add('年齡大於50歲', 'depth_monitor', 'muscle_monitor')
+    if asa > 2:
+        add(f'ASA {asa} 級', 'depth_monitor', 'muscle_monitor')
+    if frail or (age is not None and age > 65):
+        add('體弱或年長', 'depth_monitor', 'muscle_monitor')
+    if WORRY_PATTERNS['pain'].search(worry):
+        add('擔心疼痛', 'pca')
+    if WORRY_PATTERNS['nausea'].search(worry):
+        add('容易暈車或噁心', 'anti_nausea', 'depth_monitor')
+    if hours is not None and hours > 2:
+        add('手術預計超過2小時', 'anti_nausea', 'depth_monitor')
+    if WORRY_PATTERNS['cold'].search(worry):
+        add('怕冷', 'warming')
+    if hours is not None and hours > 1:
+        add('手術預計超過1小時', 'warming')
+    if WORRY_PATTERNS['anxiety'].search(worry):
+        add('失眠或精神緊張', 'depth_monitor')
+
+    return {item: reasons[item] for item in ITEMS if item in reasons}
+
+
+def _patient_info(row):
+    """Intake-style dict from a Patient row or an export row mapping"""
+    if isinstance(row, dict):
+        return row
+    return {
+        'age': row.age,
+        'cfs': row.cfs,
+        'operation': row.operation,
+        'medical_history': row.medical_history,
+        'worry': row.worry,
+    }
+
+
+def score_patients(rows):
+    """Summarize recommendations over many patients for reporting.
+
+    rows is any iterable of Patient rows or row dicts, e.g. the batches of
+    export.export_rows flattened, so the whole table can be scored in one
+    streaming pass.
+    """
+    patients = 0
+    items = Counter()
+    asa = Counter()
+    for row in rows:
+        info = _patient_info(row)
+        patients += 1
+        asa[estimate_asa(info)] += 1
+        items.update(recommend(info).keys())
+    return {
+        'patients': patients,
+        'asa': {str(level): asa[level] for level in sorted(asa)},
+        'items': {
+            key: {
+                'name': name,
+                'recommended': items[key],
+                'potential_revenue': items[key] * price,
+            }
+            for key, (name, price) in ITEMS.items()
+        },
+    }
@@ -0,0 +1,66 @@
+import threading
+from functools import lru_cache
+
+ALLOWED_TAGS = [
+    'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'ul', 'ol', 'li', 'strong', 'em', 'a',
+    'code', 'pre', 'blockquote', 'table', 'thead',
+    'tbody', 'tr', 'th', 'td', 'br', 'hr'
+]
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title'],
+    'img': ['src', 'alt', 'title']
+}
+
+# Responses up to this many characters are memoized: the fixed intake prompts
+# repeat for every patient, while LLM answers are long and rarely identical
+STATIC_MAX_LENGTH = 256
+
+# Markdown and bleach.Cleaner instances keep parser state, so each thread reuses its own
+_local = threading.local()
+
+
+def _renderers():
+    if not hasattr(_local, 'markdown'):
+        # Imported on first render rather than at worker boot
+        import bleach
+        from markdown import Markdown
+        _local.markdown = Markdown(extensions=['extra'])
+        _local.cleaner = bleach.Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True)
+    return _local.markdown, _local.cleaner
+
+
+def _render(text):
+    md, cleaner = _renderers()
+    return cleaner.clean(md.reset().convert(text))
+
+
+@lru_cache(maxsize=512)
+def _render_static(text):
+    return _render(text)
+
+
+def finished_length(text):
+    """Length of the leading part of text made of finished markdown blocks.
+
+    A block is finished once a complete blank line follows it outside a
+    fenced code block, so it renders the same whatever text comes after.
+    """
+    finished = 0
+    position = 0
+    in_fence = False
+    for line in text.splitlines(keepends=True):
+        position += len(line)
+        stripped = line.strip()
+        if stripped.startswith(('```', '~~~')):
+            in_fence = not in_fence
+        elif not stripped and not in_fence and line.endswith('\n'):
+            finished = position
+    return finished
+
+
+def render_markdown(text):
+    """Convert markdown to sanitized HTML, reusing this thread's parser and sanitizer"""
+    if len(text) <= STATIC_MAX_LENGTH:
+        return _render_static(text)
+    return _render(text)
@@ -0,0 +1,296 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class MemoryBackend:
+    """In-process LRU store; state is lost on restart and not shared between workers"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < time.time():
+            del self._values[key]
+            return None
+        self._values.move_to_end(key)
+        return entry
+
+    def _put(self, key, value, ttl):
+        self._values[key] = (value, time.time() + ttl)
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_entries:
+            self._values.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+        # Values are kept serialized so callers never share mutable state
+        return json.loads(entry[0]) if entry else None
+
+    def set(self, key, value, ttl):
+        value = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._put(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def append(self, key, value, ttl):
+        with self._lock:
+            entry = self._live(key)
+            items = entry[0] if entry else []
+            items.append(value)
+            self._put(key, items, ttl)
+
+    def get_list(self, key, start=0):
+        with self._lock:
+            entry = self._live(key)
+            return list(entry[0][start:]) if entry else []
+
+
+class SQLiteBackend:
+    """SQLite store shared by all workers on one host.
+
+    Each process opens its own connection on first use, so a store created
+    before a fork (e.g. gunicorn --preload) is never used from two processes.
+    A list keeps one expiry row per key; expired entries are filtered out on
+    read and deleted at most every ``purge_interval`` seconds, so a write
+    costs the same however many conversations or turns are stored.
+    """
+
+    def __init__(self, path, busy_timeout=5, purge_interval=60):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+    def _open(self):
+        # Every worker writes here; wait for a concurrent writer instead of failing
+        db = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS session_value "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        # Superseded by session_list_key and session_list_item, which keep one expiry per list
+        db.execute("DROP TABLE IF EXISTS session_list")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS session_list_key "
+            "(key TEXT PRIMARY KEY, expires REAL NOT NULL)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS session_list_item "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, value TEXT NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS ix_session_list_item_key ON session_list_item (key, id)")
+        db.execute("CREATE INDEX IF NOT EXISTS ix_session_value_expires ON session_value (expires)")
+        db.execute("CREATE INDEX IF NOT EXISTS ix_session_list_key_expires ON session_list_key (expires)")
+        db.commit()
+        return db
+
+    def _connection(self):
+        """This process's connection, opened on first use and again after a fork"""
+        if self._pid == os.getpid():
+            return self._db
+        if self._pid is not None:
+            # Forked: the parent's lock may be held, and its connection must not be
+            # used or closed here; keep a reference so it is never finalized
+            self._lock = threading.Lock()
+            self._inherited = self._db
+        with self._lock:
+            if self._pid != os.getpid():
+                self._db = self._open()
+                self._pid = os.getpid()
+        return self._db
+
+    def _purge(self, db, now):
+        """Delete expired entries if the last purge was long enough ago; call with the lock held"""
+        if now - self._purged_at < self.purge_interval:
+            return
+        self._purged_at = now
+        db.execute("DELETE FROM session_value WHERE expires <= ?", (now,))
+        db.execute(
+            "DELETE FROM session_list_item WHERE key IN (SELECT key FROM session_list_key WHERE expires <= ?)",
+            (now,)
+        )
+        db.execute("DELETE FROM session_list_key WHERE expires <= ?", (now,))
+
+    def get(self, key):
+        db = self._connection()
+        with self._lock:
+            row = db.execute(
+                "SELECT value FROM session_value WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        db = self._connection()
+        now = time.time()
+        with self._lock:
+            db.execute(
+                "INSERT OR REPLACE INTO session_value (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl)
+            )
+            self._purge(db, now)
+            db.commit()
+
+    def delete(self, key):
+        db = self._connection()
+        with self._lock:
+            db.execute("DELETE FROM session_value WHERE key = ?", (key,))
+            db.execute("DELETE FROM session_list_item WHERE key = ?", (key,))
+            db.execute("DELETE FROM session_list_key WHERE key = ?", (key,))
+            db.commit()
+
+    def append(self, key, value, ttl):
+        db = self._connection()
+        now = time.time()
+        with self._lock:
+            # A list that expired but is not purged yet starts over
+            expired = db.execute(
+                "SELECT 1 FROM session_list_key WHERE key = ? AND expires <= ?", (key, now)
+            ).fetchone()
+            if expired:
+                db.execute("DELETE FROM session_list_item WHERE key = ?", (key,))
+            db.execute(
+                "INSERT INTO session_list_key (key, expires) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET expires = excluded.expires",
+                (key, now + ttl)
+            )
+            db.execute(
+                "INSERT INTO session_list_item (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False))
+            )
+            self._purge(db, now)
+            db.commit()
+
+    def get_list(self, key, start=0):
+        db = self._connection()
+        with self._lock:
+            rows = db.execute(
+                "SELECT item.value FROM session_list_item AS item "
+                "JOIN session_list_key AS list ON list.key = item.key "
+                "WHERE item.key = ? AND list.expires > ? ORDER BY item.id LIMIT -1 OFFSET ?",
+                (key, time.time(), start)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class RedisBackend:
+    """Store speaking the Redis protocol.
+
+    Pass a redis URL to use redis-py, or any client object with the same
+    get/setex/delete/rpush/expire/lrange methods (e.g. a local stand-in).
+    """
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("The redis package is required for redis:// session stores")
+            client = redis.Redis.from_url(url)
+        self._client = client
+
+    def get(self, key):
+        value = self._client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.setex(key, int(ttl), json.dumps(value, ensure_ascii=False))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def append(self, key, value, ttl):
+        self._client.rpush(key, json.dumps(value, ensure_ascii=False))
+        self._client.expire(key, int(ttl))
+
+    def get_list(self, key, start=0):
+        return [json.loads(value) for value in self._client.lrange(key, start, -1)]
+
+
+def create_backend(uri):
+    """Create a store from a URI: memory://, sqlite:///path or redis://host:port/db"""
+    if uri.startswith('memory://'):
+        return MemoryBackend()
+    if uri.startswith('sqlite:///'):
+        return SQLiteBackend(uri[len('sqlite:///'):])
+    if uri.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url=uri)
+    raise ValueError(f"Unsupported session store: {uri}")
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data lives in a store; only its id goes in the cookie"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface backed by one of the stores above"""
+
+    key_prefix = 'session:'
+
+    def __init__(self, backend, ttl=24 * 3600):
+        self.backend = backend
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.backend.get(self.key_prefix + sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.backend.delete(self.key_prefix + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not (session.modified or self.should_set_cookie(app, session)):
+            return
+
+        self.backend.set(self.key_prefix + session.sid, dict(session), self.ttl)
+        response.set_cookie(
+            name,
+            session.sid,
+            max_age=self.ttl,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
@@ -18,6 +18,12 @@ function sendMessage(message) {
         addMessageToChat('user', message);
     }
 
+    // Once intake is done, stream answers as they are generated
+    if (current_step === 'chat' && message) {
+        streamMessage(message);
+        return;
+    }
+
     fetch('/chat', {
         method: 'POST',
         headers: {
@@ -82,6 +88,76 @@ function sendMessage(message) {
     });
 }
 
+function streamMessage(message) {
+    hideAllButtons();
+    const messageDiv = addMessageToChat('bot', '');
+    // Finished blocks are appended once; only the open block after them is replaced
+    const finishedDiv = document.createElement('div');
+    const tailDiv = document.createElement('div');
+    messageDiv.append(finishedDiv, tailDiv);
+
+    fetch('/chat', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ 
+            message: message,
+            user_id: userId,
+            stream: true
+        })
+    })
+    .then(response => {
+        // Busy or error responses come back as plain JSON
+        if (!response.ok) {
+            return response.json().then(data => {
+                messageDiv.innerHTML = data.response;
+                showButtons('question-buttons');
+            });
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        function read() {
+            return reader.read().then(({ done, value }) => {
+                if (done) {
+                    showButtons('question-buttons');
+                    return;
+                }
+                buffer += decoder.decode(value, { stream: true });
+
+                // Server-sent events are separated by a blank line
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+                events.forEach(event => {
+                    if (!event.startsWith('data: ')) return;
+                    const data = JSON.parse(event.slice(6));
+                    if (data.append !== undefined) {
+                        finishedDiv.insertAdjacentHTML('beforeend', data.append);
+                    }
+                    if (data.tail !== undefined) {
+                        tailDiv.innerHTML = data.tail;
+                    }
+                    if (data.response !== undefined) {
+                        // The complete answer, rendered in one piece
+                        messageDiv.innerHTML = data.response;
+                    }
+                    scrollToBottom();
+                });
+                return read();
+            });
+        }
+        return read();
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        messageDiv.innerHTML = '抱歉，發生錯誤。請稍後再試。';
+        showButtons('question-buttons');
+    });
+}
+
 function hideAllButtons() {
     document.getElementById('sex-buttons').style.display = 'none';
     document.getElementById('cfs-buttons').style.display = 'none';
@@ -102,6 +178,7 @@ function addMessageToChat(role, message) {
     messageDiv.innerHTML = message;
     chatMessages.appendChild(messageDiv);
     scrollToBottom();
+    return messageDiv;
 }
 
 function scrollToBottom() {
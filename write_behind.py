@@ -0,0 +1,167 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Background writer that applies database jobs in batched transactions.
+
+    A job is a callable that adds or changes rows on ``db.session``; it runs
+    inside an application context on the writer thread. Jobs are committed
+    together once ``batch_size`` are pending or ``flush_interval`` seconds
+    have passed since the first one, whichever comes first. Pending jobs are
+    flushed when the process exits.
+
+    With ``enabled=False`` every job is written synchronously, which is what
+    CLI scripts and tests want.
+
+    The writer thread starts on the first enqueue, and again in a forked
+    child (e.g. gunicorn --preload workers), which does not inherit the
+    parent's thread.
+    """
+
+    def __init__(self, app, db, batch_size=100, flush_interval=0.5, enabled=True):
+        self.app = app
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_lag = 0.0
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if enabled:
+            atexit.register(self.close)
+
+    def _ensure_writer(self):
+        """Start the writer thread in this process if it is not running here yet"""
+        if self._pid == os.getpid():
+            return
+        if self._pid is not None:
+            # Forked: the parent's thread is gone and its queue and locks may be
+            # mid-use; its pending jobs are the parent's to write
+            self._start_lock = threading.Lock()
+            self._stats_lock = threading.Lock()
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            logger.debug("write-behind writer started pid=%d", self._pid)
+
+    def enqueue(self, job):
+        """Queue a job; returns immediately unless write-behind is disabled"""
+        if not self.enabled:
+            self._write([(time.monotonic(), job)])
+            return
+        self._ensure_writer()
+        self._queue.put((time.monotonic(), job))
+
+    def close(self, timeout=30):
+        """Flush everything still queued and stop the writer thread"""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def lag(self):
+        """Seconds the oldest pending job has been waiting"""
+        with self._queue.mutex:
+            for item in self._queue.queue:
+                if item is not _STOP:
+                    return time.monotonic() - item[0]
+        return 0.0
+
+    def stats(self):
+        """Return queue depth, lag and write counters"""
+        with self._stats_lock:
+            return {
+                "depth": self._queue.qsize(),
+                "writer_alive": self._pid == os.getpid() and self._thread.is_alive(),
+                "lag_seconds": self.lag(),
+                "last_batch_lag_seconds": self.last_batch_lag,
+                "written": self.written,
+                "failed": self.failed,
+                "batches": self.batches,
+            }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+        # Drain whatever arrived before shutdown
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        with self.app.app_context():
+            written, failed = 0, 0
+            try:
+                for _, job in batch:
+                    job()
+                self.db.session.commit()
+                written = len(batch)
+            except Exception as e:
+                logger.warning("batch write failed, retrying jobs one by one error=%r", e)
+                self.db.session.rollback()
+                # Isolate the bad job so the rest of the batch is still saved
+                for _, job in batch:
+                    try:
+                        job()
+                        self.db.session.commit()
+                        written += 1
+                    except Exception:
+                        logger.exception("write-behind job failed")
+                        self.db.session.rollback()
+                        failed += 1
+            finally:
+                self.db.session.remove()
+
+        with self._stats_lock:
+            self.written += written
+            self.failed += failed
+            self.batches += 1
+            self.last_batch_lag = time.monotonic() - batch[0][0]